@@ -0,0 +1,37 @@
+# -*- mode: python -*-
+
+# One-dir build: modules are loaded from dist/mutagen-helper-onedir/ instead of being extracted to a temporary
+# directory on each run like with mutagen-helper.spec, so the command starts faster.
+
+block_cipher = None
+
+
+a = Analysis(['mutagen_helper/__main__.py'],
+             pathex=[],
+             binaries=[],
+             datas=[],
+             hiddenimports=[],
+             hookspath=[],
+             runtime_hooks=[],
+             excludes=['tkinter', 'unittest', 'pydoc', 'doctest'],
+             win_no_prefer_redirects=False,
+             win_private_assemblies=True,
+             cipher=block_cipher)
+pyz = PYZ(a.pure, a.zipped_data,
+             cipher=block_cipher)
+exe = EXE(pyz,
+          a.scripts,
+          [],
+          exclude_binaries=True,
+          name='mutagen-helper',
+          debug=False,
+          strip=False,
+          upx=False,
+          console=True )
+coll = COLLECT(exe,
+               a.binaries,
+               a.zipfiles,
+               a.datas,
+               strip=False,
+               upx=False,
+               name='mutagen-helper-onedir')
@@ -3,14 +3,12 @@
 """
 Main module
 """
-import json
 import logging
 import sys
 
 import click
 
 from mutagen_helper.__version__ import __version__
-from mutagen_helper.manager import Manager
 
 
 class SpecialHelpOrder(click.Group):
@@ -44,15 +42,36 @@ class SpecialHelpOrder(click.Group):
         return decorator
 
 
+def _manager(obj):
+    if obj.get('daemon'):
+        from mutagen_helper.daemon import connect
+        client = connect()
+        if client:
+            return client
+
+    # Manager pulls yaml, expandvars and subprocess handling, so it's only imported by commands that need it, keeping
+    # --help, --version and completions fast.
+    from mutagen_helper.manager import Manager
+    return Manager(cache=obj.get('cache', True), rescan=obj.get('rescan', False))
+
+
 @click.group(context_settings=dict(help_option_names=['-h', '--help']), cls=SpecialHelpOrder)
 @click.version_option(prog_name='mutagen-helper', version=__version__)
 @click.option('-v', '--verbose', default=False, is_flag=True, help="Add more output")
 @click.option('-s', '--silent', default=False, is_flag=True, help="No output at all")
-def main(verbose, silent):
+@click.option('--no-cache', default=False, is_flag=True, envvar='MUTAGEN_HELPER_NO_CACHE',
+              help="Parse configuration files again instead of using cached results")
+@click.option('--no-daemon', default=False, is_flag=True, envvar='MUTAGEN_HELPER_NO_DAEMON',
+              help="Run the command in this process even if mutagen-helper daemon is running")
+@click.option('--rescan', default=False, is_flag=True, envvar='MUTAGEN_HELPER_RESCAN',
+              help="Walk all directories to discover configuration files, in this process")
+@click.pass_context
+def main(ctx, verbose, silent, no_cache, no_daemon, rescan):
     """
     Main command group
     :return:
     """
+    ctx.obj = {'cache': not no_cache, 'rescan': rescan, 'daemon': not no_cache and not no_daemon and not rescan}
     if not silent:
         root = logging.getLogger()
         if verbose:
@@ -70,57 +89,216 @@ def main(verbose, silent):
 @main.command(help='Creates and starts a new synchronization sessions', help_priority=1)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
-def up(path=None, project=None, session=None):
-    manager = Manager()
-    manager.up(path, project, session)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def up(obj, path=None, project=None, session=None, jobs=1):
+    manager = _manager(obj)
+    manager.up(path, project, session, jobs=jobs)
 
 
 @main.command(help='Permanently terminates synchronization sessions', help_priority=2)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
-def down(path=None, project=None, session=None):
-    manager = Manager()
-    manager.down(path, project, session)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def down(obj, path=None, project=None, session=None, jobs=1):
+    manager = _manager(obj)
+    manager.down(path, project, session, jobs=jobs)
 
 
 @main.command(help='Pauses synchronization sessions', help_priority=3)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
-def pause(path=None, project=None, session=None):
-    manager = Manager()
-    manager.pause(path, project, session)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def pause(obj, path=None, project=None, session=None, jobs=1):
+    manager = _manager(obj)
+    manager.pause(path, project, session, jobs=jobs)
 
 
 @main.command(help='Resumes paused or disconnected synchronization sessions', help_priority=4)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
-def resume(path=None, project=None, session=None):
-    manager = Manager()
-    manager.resume(path, project, session)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def resume(obj, path=None, project=None, session=None, jobs=1):
+    manager = _manager(obj)
+    manager.resume(path, project, session, jobs=jobs)
 
 
 @main.command(help='Flush synchronization sessions', help_priority=4)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
-def flush(path=None, project=None, session=None):
-    manager = Manager()
-    manager.flush(path, project, session)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def flush(obj, path=None, project=None, session=None, jobs=1):
+    manager = _manager(obj)
+    manager.flush(path, project, session, jobs=jobs)
 
 
 @main.command(help='Lists existing synchronization sessions and their statuses', help_priority=5)
 @click.argument('project', required=False)
 @click.argument('session', required=False)
-@click.option('-p', '--path', required=False)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
 @click.option('-l', '--long', required=False, is_flag=True)
-def list(project=None, session=None, path=None, long=False):
-    manager = Manager()
-    ret = manager.list(path, project, session, long)
-    print(json.dumps(ret, indent=2))
+@click.option('-f', '--format', 'output_format', type=click.Choice(['json', 'ndjson']), default='json',
+              show_default=True, help="Output format, ndjson writes one compact JSON object per session")
+@click.option('--fields', required=False,
+              help="Comma separated list of fields to keep for each session (ie: Identifier,Status)")
+@click.pass_obj
+def list(obj, project=None, session=None, path=None, long=False, output_format='json', fields=None):
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    items = _manager(obj).iter_list(path, project, session, long, fields or None)
+    if output_format == 'ndjson':
+        _print_ndjson_list(items)
+    else:
+        _print_json_list(items)
+
+
+def _print_json_list(items):
+    """
+    Prints items as soon as they come, the same way json.dumps(list(items), indent=2) would.
+    """
+    import json
+
+    separator = '[\n'
+    for item in items:
+        sys.stdout.write(separator + '  ' + json.dumps(item, indent=2).replace('\n', '\n  '))
+        sys.stdout.flush()
+        separator = ',\n'
+    print('\n]' if separator == ',\n' else '[]')
+
+
+def _print_ndjson_list(items):
+    import json
+
+    for item in items:
+        sys.stdout.write(json.dumps(item, separators=(',', ':')) + '\n')
+        sys.stdout.flush()
+
+
+@main.command(help='Shows what up would do, as JSON, without changing sessions', help_priority=5)
+@click.argument('project', required=False)
+@click.argument('session', required=False)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.pass_obj
+def plan(obj, project=None, session=None, path=None):
+    import json
+
+    print(json.dumps(_manager(obj).plan(path, project, session), indent=2))
+
+
+@main.command(help='Applies a plan written by plan command', help_priority=6)
+@click.argument('plan_file', type=click.File('r'), default='-', required=False)
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def apply(obj, plan_file, jobs=1):
+    import json
+
+    try:
+        data = json.load(plan_file)
+    except ValueError as e:
+        raise click.ClickException('Invalid plan: %s' % e)
+    _manager(obj).apply(data, jobs=jobs)
+
+
+def _duration(ctx, param, value):
+    if value is None:
+        return None
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    try:
+        if value[-1:] in units:
+            return float(value[:-1]) * units[value[-1]]
+        return float(value)
+    except ValueError:
+        raise click.BadParameter('%s is not a duration (ie: 3600, 30m, 12h, 7d)' % value)
+
+
+@main.command(help='Terminates sessions which are not configured anymore', help_priority=6)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-n', '--dry-run', is_flag=True, default=False, help="Only show orphan sessions")
+@click.option('--min-age', callback=_duration, required=False,
+              help="Only terminate sessions created at least this long ago (ie: 3600, 30m, 12h, 7d)")
+@click.option('--force', is_flag=True, default=False,
+              help="Also terminate sessions of unconfigured projects with an alpha in directories discovery doesn't "
+                   "read")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.pass_obj
+def gc(obj, path=None, dry_run=False, min_age=None, force=False, jobs=1):
+    _manager(obj).gc(path, min_age=min_age, dry_run=dry_run, jobs=jobs, force=force)
+
+
+@main.command(help='Compiles configuration to load it faster', help_priority=6)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.pass_obj
+def compile(obj, path=None):
+    _manager(obj).compile(path)
+
+
+@main.command(name='clear-cache', help='Clears cached configuration files', help_priority=6)
+@click.pass_obj
+def clear_cache(obj):
+    _manager(obj).clear_cache()
+
+
+@main.command(help='Updates sessions as configuration files change', help_priority=6)
+@click.option('-p', '--path', required=False, multiple=True,
+              help="Workspace path, may be given many times (default: MUTAGEN_HELPER_PATH or current directory)")
+@click.option('-j', '--jobs', type=int, default=1, envvar='MUTAGEN_HELPER_JOBS', show_default=True,
+              help="Number of mutagen commands to run concurrently")
+@click.option('--debounce', type=float, default=0.5, envvar='MUTAGEN_HELPER_WATCH_DEBOUNCE', show_default=True,
+              help="Seconds without change to wait before applying a burst of changes")
+@click.option('--interval', type=float, required=False, envvar='MUTAGEN_HELPER_WATCH_INTERVAL',
+              help="Poll configuration files every INTERVAL seconds instead of using inotify")
+@click.pass_obj
+def watch(obj, path=None, jobs=1, debounce=0.5, interval=None):
+    # Watching is long running, so it always runs in this process.
+    from mutagen_helper.manager import Manager
+
+    manager = Manager(cache=obj.get('cache', True), rescan=obj.get('rescan', False))
+    try:
+        manager.watch(path, jobs=jobs, debounce=debounce, interval=interval)
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command(help='Runs a daemon that runs other commands faster', help_priority=7)
+@click.option('--socket', 'socket_path', required=False, envvar='MUTAGEN_HELPER_SOCKET',
+              help="Path of the unix domain socket to listen on")
+@click.option('--sessions-ttl', type=float, required=False, envvar='MUTAGEN_HELPER_SESSIONS_TTL',
+              help="Seconds a sessions listing is reused by following commands  [default: 2]")
+def serve(socket_path=None, sessions_ttl=None):
+    import signal
+    from mutagen_helper.daemon import Daemon
+
+    daemon = Daemon(socket_path, sessions_ttl=sessions_ttl)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,356 @@
+"""
+Asyncio API, to drive mutagen sessions from an event loop without worker threads.
+"""
+import asyncio
+import logging
+import os
+import shlex
+import subprocess
+import sys
+
+from .executor import Task, raise_task_errors
+from .manager import ManagerInternals, sanitize_path
+from .snapshot import SessionSnapshot, session_identifier
+from .wrapper import MutagenWrapper, MutagenRunException, ProcessTimeoutException, SessionNotFoundException
+
+
+class AsyncProcessWrapper:
+    """
+    Runs commands with asyncio subprocesses.
+
+    Standard input isn't available to commands, as there's no console to prompt the user. jobs limits how many
+    commands run at the same time, and timeout how many seconds a command may run before it's killed.
+    """
+    chunk_size = 65536
+
+    def __init__(self, jobs=None, timeout=None):
+        self.jobs = jobs
+        self.timeout = timeout
+        self._semaphore = None
+
+    async def _read(self, stream, buffer):
+        while True:
+            data = await stream.read(self.chunk_size)
+            if not data:
+                break
+            buffer.extend(data)
+
+    def _completed_process(self, process, command, stdout, stderr):
+        return subprocess.CompletedProcess(command, process.returncode,
+                                           str(bytes(stdout), encoding=sys.stdout.encoding),
+                                           str(bytes(stderr), encoding=sys.stdout.encoding))
+
+    async def run(self, command, timeout=None):
+        if self.jobs and self._semaphore is None:
+            # Created on first use, so it belongs to the running event loop.
+            self._semaphore = asyncio.Semaphore(self.jobs)
+        if self._semaphore:
+            async with self._semaphore:
+                return await self._run(command, timeout)
+        return await self._run(command, timeout)
+
+    async def _run(self, command, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        logging.debug('Running command: %s' % shlex.quote(' '.join(command)))
+
+        process = await asyncio.create_subprocess_exec(*command,
+                                                       stdin=subprocess.DEVNULL,
+                                                       stdout=subprocess.PIPE,
+                                                       stderr=subprocess.PIPE)
+        stdout = bytearray()
+        stderr = bytearray()
+        reading = asyncio.gather(self._read(process.stdout, stdout),
+                                 self._read(process.stderr, stderr),
+                                 process.wait())
+        try:
+            await asyncio.wait_for(reading, timeout)
+        except asyncio.TimeoutError:
+            raise ProcessTimeoutException("Command has timed out after %s seconds: %s" % (
+                timeout, shlex.quote(' '.join(command))[1:-1]),
+                result=self._completed_process(process, command, stdout, stderr))
+        finally:
+            if reading.done() and not reading.cancelled():
+                # Mark the exception of interrupted reads as retrieved.
+                reading.exception()
+            if process.returncode is None:
+                # Timed out or cancelled.
+                process.kill()
+                await process.wait()
+        return self._completed_process(process, command, stdout, stderr)
+
+
+class AsyncMutagenWrapper:
+    """
+    Coroutine counterpart of MutagenWrapper, which is still used to build commands and parse their output.
+    """
+
+    def __init__(self, mutagen="mutagen.exe" if os.name == 'nt' else "mutagen", jobs=None, timeout=None):
+        self.mutagen = mutagen
+        self.commands = MutagenWrapper(mutagen)
+        self.process_wrapper = AsyncProcessWrapper(jobs=jobs, timeout=timeout)
+
+    async def run(self, command, timeout=None):
+        if timeout is None and self.process_wrapper.timeout is None and len(command) > 1:
+            # Same default timeouts as MutagenWrapper.
+            timeout = self.commands.timeouts.get(command[1])
+        result = await self.process_wrapper.run([self.mutagen] + command, timeout=timeout)
+        return self.commands._check_result(command, result)
+
+    async def create(self, alpha, beta, options=None, timeout=None):
+        result = await self.run(self.commands._create_command(alpha, beta, options), timeout=timeout)
+        return self.commands._created_session_id(result)
+
+    async def _session_control(self, command, session_id, label_selector, one, timeout):
+        result = await self.run(self.commands._session_control_command(command, session_id, label_selector),
+                                timeout=timeout)
+        return self.commands._handle_result(result, self.commands._controlled_session_ids(command, result), one)
+
+    async def terminate(self, session_id=None, label_selector=None, one=False, timeout=None):
+        return await self._session_control('terminate', session_id, label_selector, one, timeout)
+
+    async def flush(self, session_id=None, label_selector=None, one=False, timeout=None):
+        return await self._session_control('flush', session_id, label_selector, one, timeout)
+
+    async def pause(self, session_id=None, label_selector=None, one=False, timeout=None):
+        return await self._session_control('pause', session_id, label_selector, one, timeout)
+
+    async def resume(self, session_id=None, label_selector=None, one=False, timeout=None):
+        return await self._session_control('resume', session_id, label_selector, one, timeout)
+
+    async def list(self, session_id=None, label_selector=None, long=False, one=False, timeout=None):
+        commands = self.commands
+        args = commands._list_command(session_id, label_selector)
+
+        if not long and commands.json_list is not False:
+            try:
+                result = await self.run(args + ['--template', commands.json_list_template], timeout=timeout)
+            except SessionNotFoundException:
+                return []
+            except MutagenRunException as e:
+                if commands.json_list:
+                    raise
+                logging.debug('Mutagen doesn\'t support structured listing, falling back to text listing (%s)' % e)
+                commands.json_list = False
+            else:
+                commands.json_list = True
+                return commands._handle_result(result, commands.json_list_parser.parse(result.stdout, result), one)
+
+        if long:
+            args.append('--long')
+        try:
+            result = await self.run(args, timeout=timeout)
+        except SessionNotFoundException:
+            return []
+        return commands._handle_result(result, commands.list_parser.parse(result.stdout, result), one)
+
+
+class AsyncTaskExecutor:
+    """
+    Runs Task coroutines concurrently, with the same group limits and delays as TaskExecutor.
+    """
+
+    def __init__(self, group_jobs=None, group_delays=None):
+        self.group_jobs = group_jobs or {}
+        self.group_delays = group_delays or {}
+
+    async def run(self, tasks):
+        tasks = list(tasks)
+        loop = asyncio.get_event_loop()
+        semaphores = {group: asyncio.Semaphore(int(jobs)) for group, jobs in self.group_jobs.items()}
+        next_starts = {}
+
+        async def run_task(task):
+            semaphore = semaphores.get(task.group) if task.group is not None else None
+            if semaphore:
+                await semaphore.acquire()
+            try:
+                delay = self.group_delays.get(task.group) if task.group is not None else None
+                if delay:
+                    now = loop.time()
+                    start = max(now, next_starts.get(task.group, now))
+                    next_starts[task.group] = start + delay
+                    if start > now:
+                        await asyncio.sleep(start - now)
+                return await task()
+            finally:
+                if semaphore:
+                    semaphore.release()
+
+        outcomes = await asyncio.gather(*(run_task(task) for task in tasks), return_exceptions=True)
+
+        errors = []
+        for task, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, BaseException):
+                if isinstance(outcome, asyncio.CancelledError):
+                    raise outcome
+                logging.debug('Task %s has failed: %s' % (task.name, outcome), exc_info=outcome)
+                errors.append((task, outcome))
+        raise_task_errors(errors)
+        return outcomes
+
+
+class AsyncManager:
+    """
+    Coroutine counterpart of Manager.
+
+    Configuration files are still parsed by ManagerInternals, in the default executor, and mutagen commands of a call
+    run concurrently. jobs limits how many mutagen commands run at the same time, and timeout is the default number
+    of seconds allowed to each mutagen command.
+    """
+
+    def __init__(self, cache=True, jobs=None, timeout=None):
+        self._internals = ManagerInternals(cache=cache)
+        self.wrapper = AsyncMutagenWrapper(jobs=jobs, timeout=timeout)
+
+    def _sanitize_path(self, path):
+        return sanitize_path(path)
+
+    async def _load_project_files(self, path):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._internals._load_project_files, self._sanitize_path(path))
+
+    async def _snapshot(self, long=False):
+        sessions = await self.wrapper.list(long=long)
+        if self._internals.session_index:
+            self._internals.session_index.refresh(sessions)
+        return SessionSnapshot(sessions)
+
+    def _save_index(self):
+        if self._internals.session_index:
+            self._internals.session_index.save()
+
+    async def up(self, path=None, project=None, session=None):
+        internals = self._internals
+        try:
+            snapshot = await self._snapshot()
+            project_files = await self._load_project_files(path)
+            betas = internals._project_files_betas(project_files, snapshot.betas())
+
+            tasks = []
+            group_jobs = {}
+            group_delays = {}
+            for target_project, target_session in internals._iter_targets(project_files, betas, True,
+                                                                          project, session):
+                project_name = target_project['project_name']
+                host = internals._beta_host(internals._effective_beta(target_session, project_name))
+                if host:
+                    internals._add_host_limits(host, target_session, group_jobs, group_delays)
+                tasks.append(Task(self._up_session, project_name, target_session, snapshot,
+                                  name='%s[%s]' % (project_name, target_session['name']), group=host))
+
+            results = await AsyncTaskExecutor(group_jobs, group_delays).run(tasks)
+            return [session_id for session_id in results if session_id is not None]
+        finally:
+            self._save_index()
+
+    async def _up_session(self, project_name, session, snapshot):
+        internals = self._internals
+        name = session['name']
+
+        alpha, beta, options = internals._create_arguments(project_name, session)
+        session_info = internals._find_one(snapshot, project_name, name)
+        if session_info and not internals._drifted(session_info, options):
+            logging.info('Session %s[%s] (%s) already exists.'
+                         % (project_name, name, session_identifier(session_info)))
+            return
+        elif session_info:
+            logging.info('Session %s[%s] (%s) configuration has changed, recreating it.'
+                         % (project_name, name, session_identifier(session_info)))
+            internals._discard_sessions(await self.wrapper.terminate(session_id=session_identifier(session_info)),
+                                        snapshot)
+
+        session_id = await self.wrapper.create(alpha, beta, options)
+        logging.info('Session %s[%s] (%s) created.' % (project_name, name, session_id))
+        if internals.session_index:
+            internals.session_index.add(project_name, name, session_id)
+        return session_id
+
+    async def _control(self, path, command, project=None, session=None):
+        internals = self._internals
+        try:
+            snapshot = None if internals.session_index else await self._snapshot()
+            project_files = await self._load_project_files(path)
+            betas = internals._project_files_betas(project_files, snapshot.betas() if snapshot else dict())
+            targets = internals._control_targets(project_files, betas, project, session)
+
+            if internals.session_index and not all(target[1] is not None and internals.session_index.find(*target)
+                                                   for target, _ in targets):
+                # Some targets are whole projects, or unknown to the session index.
+                snapshot = await self._snapshot()
+            batches = self._resolve_batches(targets, snapshot, use_index=True)
+
+            tasks = [Task(self._control_batch, command, batch, name=internals._batch_name(batch), group=host)
+                     for host, batch in batches]
+            return internals._report_control(command, await AsyncTaskExecutor().run(tasks))
+        finally:
+            self._save_index()
+
+    def _resolve_batches(self, targets, snapshot, use_index=True):
+        internals = self._internals
+        resolved = []
+        for target, host in targets:
+            session_ids = internals._target_session_ids(target, snapshot, use_index=use_index)
+            if session_ids:
+                resolved.append((target, session_ids, host))
+        return list(internals._control_batches(resolved))
+
+    async def _control_batch(self, command, batch):
+        internals = self._internals
+        control_function = getattr(self.wrapper, command)
+        owners = internals._batch_owners(batch)
+        try:
+            handled = internals._batch_handled(batch, owners, await control_function(session_id=list(owners)))
+        except SessionNotFoundException:
+            logging.debug('Some session identifiers are stale, looking for sessions with labels.')
+            return await self._control_listed(control_function, [target for target, _ in batch])
+
+        # Identifiers from the session index may be stale, single session targets must handle exactly one session.
+        handled_counts = dict((target, len(session_ids)) for target, session_ids in handled)
+        missed = [target for target, _ in batch if target[1] is not None and handled_counts.get(target, 0) != 1]
+        return handled + (await self._control_listed(control_function, missed, set(owners)) if missed else [])
+
+    async def _control_listed(self, control_function, targets, requested=()):
+        """
+        Runs a control command on listed sessions of targets, except requested identifiers.
+        """
+        internals = self._internals
+        snapshot = await self._snapshot()
+        ret = []
+        for _, batch in self._resolve_batches([(target, None) for target in targets], snapshot, use_index=False):
+            batch = [(target, [session_id for session_id in session_ids if session_id not in requested])
+                     for target, session_ids in batch]
+            batch = [(target, session_ids) for target, session_ids in batch if session_ids]
+            if batch:
+                owners = internals._batch_owners(batch)
+                ret.extend(internals._batch_handled(batch, owners, await control_function(session_id=list(owners))))
+        return ret
+
+    async def down(self, path=None, project=None, session=None):
+        return await self._control(path, 'terminate', project, session)
+
+    async def flush(self, path=None, project=None, session=None):
+        return await self._control(path, 'flush', project, session)
+
+    async def pause(self, path=None, project=None, session=None):
+        return await self._control(path, 'pause', project, session)
+
+    async def resume(self, path=None, project=None, session=None):
+        return await self._control(path, 'resume', project, session)
+
+    async def list(self, path=None, project=None, session=None, long=False):
+        internals = self._internals
+        try:
+            snapshot = await self._snapshot(long=long)
+            project_files = await self._load_project_files(path)
+            betas = internals._project_files_betas(project_files, snapshot.betas())
+
+            ret = []
+            for target_project, target_session in internals._iter_targets(project_files, betas, True,
+                                                                          project, session):
+                project_name = target_project['project_name']
+                session_info = internals._find_one(snapshot, project_name, target_session['name'])
+                if session_info:
+                    ret.append(internals._list_session(project_name, target_session, session_info))
+            return ret
+        finally:
+            self._save_index()
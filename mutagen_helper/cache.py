@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .db import Database
+
+
+def _stat(path, directory=False):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, None if directory else stat.st_size]
+
+
+def _variables_hash(variables):
+    values = [(name, os.environ.get(name)) for name in sorted(variables)]
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+class ConfigurationCache:
+    """
+    Persistent cache of parsed configuration files.
+
+    Entries are stored in the database, and are valid as long as stats (mtime and size) of every file and directory
+    read while parsing are unchanged, and environment variables referenced by the configuration have the same values.
+    Least recently used entries are evicted when there are more than max_entries.
+    """
+    section = 'configurations'
+    version = 1
+
+    # Avoid writing the database on each hit just to refresh the last use time.
+    touch_interval = 3600
+
+    def __init__(self, database=None, max_entries=None):
+        self.database = database or Database()
+        self.max_entries = max_entries or int(os.environ.get('MUTAGEN_HELPER_CACHE_SIZE', 512))
+        self._entries = None
+        self._dirty = False
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            data = self.database.read(self.section)
+            self._entries = data.get('entries', {}) if data.get('version') == self.version else {}
+        return self._entries
+
+    def get(self, configuration_filepath):
+        entry = self.entries.get(os.path.abspath(configuration_filepath))
+        if not entry or entry.get('filepath') != configuration_filepath:
+            return None
+
+        for path, stat in entry['files'].items():
+            if _stat(path) != stat:
+                return None
+        for path, stat in entry['directories'].items():
+            if _stat(path, directory=True) != stat:
+                return None
+        if _variables_hash(entry['variables']) != entry['variables_hash']:
+            return None
+
+        now = time.time()
+        if now - entry.get('used', 0) > self.touch_interval:
+            entry['used'] = now
+            self._dirty = True
+        return entry['projects']
+
+    def put(self, configuration_filepath, projects, tracker):
+        try:
+            if json.loads(json.dumps(projects)) != projects:
+                return
+        except (TypeError, ValueError):
+            logging.debug('Configuration %s can\'t be cached.' % configuration_filepath)
+            return
+
+        self.entries[os.path.abspath(configuration_filepath)] = {
+            'filepath': configuration_filepath,
+            'files': {path: _stat(path) for path in tracker.files},
+            'directories': {path: _stat(path, directory=True) for path in tracker.directories},
+            'variables': sorted(tracker.variables),
+            'variables_hash': _variables_hash(tracker.variables),
+            'projects': projects,
+            'used': time.time()
+        }
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            evicted = sorted(entries, key=lambda key: entries[key].get('used', 0))[:len(entries) - self.max_entries]
+            for key in evicted:
+                del entries[key]
+        self.database.write(self.section, {'version': self.version, 'entries': entries})
+        self._dirty = False
+
+    def clear(self):
+        self._entries = {}
+        self._dirty = False
+        self.database.write(self.section, None)
+
+
+class DiscoveryIndex:
+    """
+    Persistent index of directories read while discovering configuration files.
+
+    Each entry holds the configuration filename and subdirectories found in a directory, and is valid as long as the
+    mtime of this directory is unchanged, so a warm discovery only stats indexed directories. With rescan, entries are
+    ignored and replaced.
+    """
+    section = 'discovery'
+    version = 1
+
+    def __init__(self, database=None, rescan=False):
+        self.database = database or Database()
+        self.rescan = rescan
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            data = {} if self.rescan else self.database.read(self.section)
+            self._entries = data.get('entries', {}) if data.get('version') == self.version else {}
+        return self._entries
+
+    def scan(self, path, prune, read_directory):
+        """
+        :return: configuration filename or None, and subdirectory names of a directory, from the index when its mtime
+        is unchanged, or from read_directory(path, prune)
+        """
+        key = os.path.abspath(path)
+        stat = _stat(path, directory=True)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry and stat and entry['stat'] == stat and entry['prune'] == prune:
+            return entry['configuration'], entry['directories']
+
+        configuration, directories = read_directory(path, prune)
+        with self._lock:
+            if entry:
+                for name in set(entry['directories']) - set(directories):
+                    self._discard(os.path.join(key, name))
+            if stat:
+                self.entries[key] = {'stat': stat, 'prune': list(prune), 'configuration': configuration,
+                                     'directories': directories}
+            else:
+                self.entries.pop(key, None)
+            self._dirty = True
+        return configuration, directories
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            for name in entry['directories']:
+                self._discard(os.path.join(key, name))
+
+    def save(self):
+        if not self._dirty:
+            return
+        self.database.write(self.section, {'version': self.version, 'entries': self.entries})
+        self._dirty = False
+
+    def clear(self):
+        self._entries = {}
+        self._dirty = False
+        self.database.write(self.section, None)
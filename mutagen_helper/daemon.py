@@ -0,0 +1,334 @@
+"""
+Resident mode, where a daemon keeps configuration, session identifiers and a recent sessions listing in memory, and
+runs commands sent by the CLI over a unix domain socket.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+
+from click import ClickException
+
+from .__version__ import __version__
+from .db import home_path
+
+# Commands of Manager the daemon can run.
+commands = ['up', 'down', 'pause', 'resume', 'flush', 'list', 'plan', 'apply', 'gc', 'compile', 'clear_cache']
+
+# Environment variables read by each command, the daemon applies values of the client while its command runs. Other
+# MUTAGEN_* variables, HOME and PATH are read once by the daemon or select another mutagen daemon, so clients with other
+# values run their commands in their own process.
+request_variables = {
+    'MUTAGEN_HELPER_ALPHA', 'MUTAGEN_HELPER_BETA', 'MUTAGEN_HELPER_APPEND_PROJECT_NAME_TO_BETA', 'MUTAGEN_HELPER_PATH',
+    'MUTAGEN_HELPER_DEPTH', 'MUTAGEN_HELPER_PRUNE', 'MUTAGEN_HELPER_JOBS', 'MUTAGEN_HELPER_MAX_JOBS_PER_HOST',
+    'MUTAGEN_HELPER_RAMP_UP_DELAY', 'MUTAGEN_HELPER_NO_CACHE', 'MUTAGEN_HELPER_NO_DAEMON', 'MUTAGEN_HELPER_RESCAN',
+    'MUTAGEN_HELPER_SOCKET', 'MUTAGEN_HELPER_WATCH_DEBOUNCE', 'MUTAGEN_HELPER_WATCH_INTERVAL'
+}
+
+
+def socket_path():
+    return os.environ.get('MUTAGEN_HELPER_SOCKET', os.path.join(home_path(), 'daemon.sock'))
+
+
+def settings():
+    """
+    Version and environment variables which must be the same for the daemon and its clients.
+    """
+    environ = dict((name, value) for name, value in os.environ.items()
+                   if name in ('HOME', 'PATH') or name.startswith('MUTAGEN_') and name not in request_variables)
+    return {'version': __version__, 'environ': environ}
+
+
+class DaemonException(ClickException):
+    pass
+
+
+def _send(stream, message):
+    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+def _receive(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+class DaemonClient:
+    """
+    Manager lookalike, sending commands to the daemon.
+
+    Logs of the daemon are emitted again by the local root logger, and list items are yielded as they come.
+    """
+
+    def __init__(self, path, connection=None):
+        self.path = path
+        self._connection = connection
+
+    def _connect(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.path)
+            except OSError as e:
+                connection.close()
+                raise DaemonException('Unable to connect to mutagen-helper daemon on %s: %s' % (self.path, e))
+        return connection
+
+    def close(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def _request(self, command, **kwargs):
+        # Default path is resolved by the daemon, with the environment and working directory of this process.
+        connection = self._connect()
+        stream = connection.makefile('rwb')
+        try:
+            _send(stream, {
+                'command': command,
+                'kwargs': kwargs,
+                'cwd': os.getcwd(),
+                'environ': dict(os.environ),
+                'level': logging.getLogger().getEffectiveLevel()
+            })
+            while True:
+                message = _receive(stream)
+                if message is None:
+                    raise DaemonException('Connection to mutagen-helper daemon has been lost.')
+                if 'log' in message:
+                    logging.log(message['log']['level'], message['log']['message'])
+                elif 'item' in message:
+                    yield message['item']
+                elif 'error' in message:
+                    e = DaemonException(message['error']['message'])
+                    e.exit_code = message['error']['exit_code']
+                    raise e
+                else:
+                    return message.get('result')
+        finally:
+            stream.close()
+            connection.close()
+
+    def _result(self, command, **kwargs):
+        generator = self._request(command, **kwargs)
+        while True:
+            try:
+                next(generator)
+            except StopIteration as e:
+                return e.value
+
+    def up(self, path=None, project=None, session=None, jobs=1):
+        return self._result('up', path=path, project=project, session=session, jobs=jobs)
+
+    def down(self, path=None, project=None, session=None, jobs=1):
+        return self._result('down', path=path, project=project, session=session, jobs=jobs)
+
+    def pause(self, path=None, project=None, session=None, jobs=1):
+        return self._result('pause', path=path, project=project, session=session, jobs=jobs)
+
+    def resume(self, path=None, project=None, session=None, jobs=1):
+        return self._result('resume', path=path, project=project, session=session, jobs=jobs)
+
+    def flush(self, path=None, project=None, session=None, jobs=1):
+        return self._result('flush', path=path, project=project, session=session, jobs=jobs)
+
+    def list(self, path=None, project=None, session=None, long=False, fields=None):
+        return list(self.iter_list(path, project, session, long, fields))
+
+    def iter_list(self, path=None, project=None, session=None, long=False, fields=None):
+        # Fields are kept by the daemon, so other fields aren't sent over the socket.
+        return self._request('list', path=path, project=project, session=session, long=long, fields=fields)
+
+    def plan(self, path=None, project=None, session=None):
+        return self._result('plan', path=path, project=project, session=session)
+
+    def apply(self, plan, jobs=1):
+        return self._result('apply', plan=plan, jobs=jobs)
+
+    def gc(self, path=None, min_age=None, dry_run=False, jobs=1, force=False):
+        return self._result('gc', path=path, min_age=min_age, dry_run=dry_run, jobs=jobs, force=force)
+
+    def compile(self, path=None):
+        return self._result('compile', path=path)
+
+    def clear_cache(self):
+        return self._result('clear_cache')
+
+
+def _open(path):
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError as e:
+        logging.debug('Unable to connect to mutagen-helper daemon on %s: %s' % (path, e))
+        connection.close()
+        return None
+    return connection
+
+
+def connect(path=None):
+    """
+    Connects to the daemon.
+
+    :return: a DaemonClient, or None if the daemon isn't running, or runs another version or with another environment
+    """
+    path = path or socket_path()
+    connection = _open(path)
+    if connection is None:
+        return None
+    client = DaemonClient(path, connection)
+    try:
+        daemon_settings = client._result('settings')
+    except DaemonException as e:
+        logging.debug('Unable to use mutagen-helper daemon on %s: %s' % (path, e.format_message()))
+        return None
+    if daemon_settings != settings():
+        logging.debug('mutagen-helper daemon on %s runs another version or with another environment, running '
+                      'command in this process.' % path)
+        return None
+    return client
+
+
+class _ClientLogHandler(logging.Handler):
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def emit(self, record):
+        try:
+            _send(self.stream, {'log': {'level': record.levelno, 'message': self.format(record)}})
+        except (OSError, ValueError):
+            pass
+
+
+class Daemon:
+    """
+    Runs commands received on a unix domain socket with a single Manager, one command at a time.
+
+    The client environment and working directory are applied while its command runs, so configuration files are
+    parsed and mutagen is run as they would be by the CLI. Clients only use the daemon if it has the same settings.
+    """
+
+    def __init__(self, path=None, sessions_ttl=None):
+        from .manager import Manager
+
+        self.path = path or socket_path()
+        if sessions_ttl is None:
+            sessions_ttl = float(os.environ.get('MUTAGEN_HELPER_SESSIONS_TTL', 2))
+        self.manager = Manager(sessions_ttl=sessions_ttl)
+        # Nobody is there to answer prompts.
+        self.manager._internals.wrapper.interactive = False
+        self.settings = settings()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DaemonException('Daemon requires unix domain sockets, which are not available on this platform.')
+        connection = _open(self.path)
+        if connection:
+            connection.close()
+            raise DaemonException('mutagen-helper daemon is already running on %s.' % self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            self._server.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._server.listen(16)
+        logging.info('mutagen-helper daemon is listening on %s.' % self.path)
+        try:
+            while True:
+                try:
+                    connection, _ = self._server.accept()
+                except OSError:
+                    # Closed by shutdown.
+                    break
+                thread = threading.Thread(target=self._handle, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self._server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def shutdown(self):
+        if self._server:
+            try:
+                # Wakes up accept() on linux, which close() doesn't do.
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+
+    def _handle(self, connection):
+        stream = connection.makefile('rwb')
+        try:
+            request = _receive(stream)
+            if request is None:
+                return
+            if request.get('command') == 'settings':
+                _send(stream, {'result': self.settings})
+                return
+            with self._lock:
+                self._run(request, stream)
+        except (OSError, ValueError) as e:
+            logging.debug('Unable to handle daemon client request: %s' % e)
+        finally:
+            try:
+                stream.close()
+            except OSError:
+                # Client has gone away.
+                pass
+            connection.close()
+
+    def _run(self, request, stream):
+        command = request.get('command')
+        if command not in commands:
+            _send(stream, {'error': {'message': 'Unknown command: %s' % command, 'exit_code': 1}})
+            return
+
+        root = logging.getLogger()
+        handler = _ClientLogHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        level = root.level
+        environ = dict(os.environ)
+        cwd = os.getcwd()
+        root.addHandler(handler)
+        root.setLevel(request.get('level', logging.INFO))
+        try:
+            os.environ.clear()
+            os.environ.update(request.get('environ', environ))
+            os.chdir(request.get('cwd', cwd))
+
+            kwargs = request.get('kwargs', {})
+            if command == 'list':
+                for item in self.manager.iter_list(**kwargs):
+                    _send(stream, {'item': item})
+                result = None
+            else:
+                result = getattr(self.manager, command)(**kwargs)
+            message = {'result': result}
+        except ClickException as e:
+            message = {'error': {'message': e.format_message(), 'exit_code': e.exit_code}}
+        except Exception as e:
+            logging.debug('Command %s has failed.' % command, exc_info=True)
+            message = {'error': {'message': str(e), 'exit_code': 1}}
+        finally:
+            root.removeHandler(handler)
+            root.setLevel(level)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+        # Sent once the daemon environment is back, so the client doesn't race with it in the same process.
+        _send(stream, message)
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import tempfile
+
+
+def home_path():
+    return os.environ.get("MUTAGEN_HELPER_HOME", os.path.join(os.path.expanduser("~"), ".mutagen-helper"))
+
+
+def db_directory():
+    return os.path.join(home_path(), "db")
+
+
+class Database:
+    """
+    JSON documents stored in mutagen-helper home directory, one file per section.
+
+    Reading a section doesn't parse other ones, and processes writing different sections don't overwrite each other.
+    Files are replaced atomically, so a section is never read half written.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or db_directory()
+
+    def _filepath(self, section):
+        return os.path.join(self.directory, '%s.json' % section)
+
+    def read(self, section):
+        filepath = self._filepath(section)
+        try:
+            with open(filepath, 'r') as stream:
+                value = json.load(stream)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.debug('Unable to read database %s: %s' % (filepath, e))
+            return {}
+        return value if isinstance(value, dict) else {}
+
+    def write(self, section, value):
+        """
+        Replace a section, or remove it when value is empty.
+        """
+        filepath = self._filepath(section)
+        try:
+            if not value:
+                if os.path.exists(filepath):
+                    os.unlink(filepath)
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_filepath = tempfile.mkstemp(dir=self.directory, prefix='.%s-' % section, suffix='.json')
+            try:
+                with os.fdopen(fd, 'w') as stream:
+                    json.dump(value, stream, separators=(',', ':'))
+                os.replace(tmp_filepath, filepath)
+            except BaseException:
+                os.unlink(tmp_filepath)
+                raise
+        except OSError as e:
+            logging.debug('Unable to write database %s: %s' % (filepath, e))
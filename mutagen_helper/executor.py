@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from click import ClickException
+
+_console_lock = threading.RLock()
+_local = threading.local()
+
+
+class TaskExecutionException(ClickException):
+    def __init__(self, message, errors):
+        self.errors = errors
+        super().__init__(message)
+
+
+class _TaskLogBuffer(logging.Filter):
+    """
+    Root logger filter holding back records emitted by a running task, so they can be written in a row once done.
+    """
+
+    def filter(self, record):
+        records = getattr(_local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+def _flush_task_logs():
+    records = getattr(_local, 'records', None)
+    _local.records = None
+    if records:
+        root = logging.getLogger()
+        for record in records:
+            root.handle(record)
+
+
+def acquire_console(blocking=True):
+    """
+    Acquire exclusive access to the console, for a subprocess to interact with the user.
+
+    Logs held back for the current task are written first, and are not buffered anymore until the task ends.
+    """
+    if not _console_lock.acquire(blocking):
+        return False
+    _flush_task_logs()
+    return True
+
+
+def release_console():
+    _console_lock.release()
+
+
+def raise_task_errors(errors):
+    """
+    Raise (task, error) failures, as is if there's a single one or together as a TaskExecutionException.
+    """
+    if len(errors) == 1:
+        raise errors[0][1]
+    if errors:
+        lines = ['%i tasks have failed.' % len(errors)]
+        for task, error in errors:
+            message = error.format_message() if isinstance(error, ClickException) else str(error)
+            lines.append('- %s: %s' % (task.name, message))
+        raise TaskExecutionException('\n'.join(lines), errors)
+
+
+class Task:
+    def __init__(self, function, *args, name=None, group=None, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name
+        self.group = group
+
+    def __call__(self):
+        return self.function(*self.args, **self.kwargs)
+
+
+class TaskExecutor:
+    """
+    Run tasks sequentially, or on a pool of worker threads when many jobs are allowed.
+
+    Tasks may belong to a group (like a beta host). group_jobs limits how many tasks of a group run at the same time,
+    and group_delays how many seconds to wait between two task starts of a group.
+    """
+
+    def __init__(self, jobs=1, group_jobs=None, group_delays=None):
+        self.jobs = max(1, jobs or 1)
+        self.group_jobs = group_jobs or {}
+        self.group_delays = group_delays or {}
+
+    def run(self, tasks):
+        """
+        Run all tasks, and return their results in the same order.
+
+        In sequential mode, the first failure is raised right away. With many jobs, every task is run and failures
+        are raised together as a TaskExecutionException (or as is, if there's a single one).
+        """
+        tasks = list(tasks)
+        if self.jobs == 1 or len(tasks) <= 1:
+            return self._run_sequential(tasks)
+
+        log_buffer = _TaskLogBuffer()
+        root = logging.getLogger()
+        root.addFilter(log_buffer)
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.jobs, len(tasks))) as pool:
+                outcomes = self._schedule(pool, tasks)
+        finally:
+            root.removeFilter(log_buffer)
+
+        results = []
+        errors = []
+        for task, (result, error) in zip(tasks, outcomes):
+            if error is not None:
+                errors.append((task, error))
+            results.append(result)
+
+        raise_task_errors(errors)
+        return results
+
+    def _run_sequential(self, tasks):
+        next_starts = {}
+        results = []
+        for task in tasks:
+            delay = self.group_delays.get(task.group) if task.group is not None else None
+            if delay:
+                remaining = next_starts.get(task.group, 0) - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                next_starts[task.group] = time.monotonic() + delay
+            results.append(task())
+        return results
+
+    def _schedule(self, pool, tasks):
+        """
+        Submit tasks to the pool as soon as a worker, the group limit and the group delay allow it.
+
+        Tasks are only handed to workers once they are allowed to start, so a busy group never holds workers that
+        could run tasks of other groups.
+        """
+        outcomes = [None] * len(tasks)
+        pending = list(enumerate(tasks))
+        running = {}
+        group_running = {}
+        next_starts = {}
+
+        while pending or running:
+            now = time.monotonic()
+            wake_up = None
+            for item in list(pending):
+                if len(running) >= self.jobs:
+                    break
+                index, task = item
+                group = task.group
+                if group is not None:
+                    limit = self.group_jobs.get(group)
+                    if limit and group_running.get(group, 0) >= limit:
+                        continue
+                    next_start = next_starts.get(group, now)
+                    if next_start > now:
+                        wake_up = next_start if wake_up is None else min(wake_up, next_start)
+                        continue
+                    group_running[group] = group_running.get(group, 0) + 1
+                    delay = self.group_delays.get(group)
+                    if delay:
+                        next_starts[group] = now + delay
+                pending.remove(item)
+                running[pool.submit(self._run_task, task)] = (index, task)
+
+            timeout = max(0.0, wake_up - time.monotonic()) if wake_up is not None else None
+            if not running:
+                # Pending tasks only wait for a group delay, wait() would return at once on no futures.
+                time.sleep(timeout or 0.0)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, task = running.pop(future)
+                if task.group is not None:
+                    group_running[task.group] -= 1
+                outcomes[index] = future.result()
+
+        return outcomes
+
+    def _run_task(self, task):
+        _local.records = []
+        try:
+            return task(), None
+        except Exception as e:
+            logging.debug('Task %s has failed: %s' % (task.name, e), exc_info=True)
+            return None, e
+        finally:
+            with _console_lock:
+                _flush_task_logs()
@@ -1,19 +1,97 @@
-import copy
+import calendar
+import hashlib
+import json
 import logging
 import os
+import re
+import tempfile
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from click import ClickException
 
 from mutagen_helper import scanner
+from .cache import ConfigurationCache, DiscoveryIndex, _stat, _variables_hash
+from .db import home_path
+from .executor import Task, TaskExecutor
+from .model import Project
 from .parser import ProjectParser
-from .wrapper import MutagenWrapper
+from .snapshot import SessionIndex, SessionSnapshot, session_identifier, session_labels
+from .wrapper import MutagenWrapper, MultipleSessionsException, SessionNotFoundException
+
+_remote_url_pattern = re.compile(r'^(?:[^@:/\\]+@)?(?P<host>[^@:/\\]{2,})(?::\d+)?:')
+_docker_url_pattern = re.compile(r'^docker://(?:[^@/]+@)?(?P<host>[^/]+)')
+_creation_time_pattern = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(\.\d+)?'
+                                    r'(?:Z|(?P<sign>[+-])(?P<hours>\d{2}):(?P<minutes>\d{2}))$')
+
+
+def _creation_timestamp(creation_time):
+    """
+    Timestamp of a mutagen RFC 3339 creation time, or None if it can't be parsed.
+    """
+    match = _creation_time_pattern.match(creation_time or '')
+    if not match:
+        return None
+    timestamp = calendar.timegm(tuple(int(group) for group in match.groups()[:6]))
+    timestamp += float(match.group(7) or 0)
+    if match.group('sign'):
+        offset = int(match.group('hours')) * 3600 + int(match.group('minutes')) * 60
+        timestamp += -offset if match.group('sign') == '+' else offset
+    return timestamp
+
+
+class PlanException(ClickException):
+    pass
+
+
+def sanitize_path(path=None):
+    """
+    Path given to a command, paths of MUTAGEN_HELPER_PATH environment variable (separated by os.pathsep), or current
+    working directory. Many paths are returned as a list.
+    """
+    if path:
+        if isinstance(path, (list, tuple)):
+            return list(path) if len(path) > 1 else path[0]
+        return path
+    paths = [item for item in os.environ.get('MUTAGEN_HELPER_PATH', '').split(os.pathsep) if item]
+    if len(paths) > 1:
+        return paths
+    return paths[0] if paths else os.getcwd()
+
 
-db_filepath = os.path.join(
-    os.environ.get("MUTAGEN_HELPER_HOME", os.path.join(os.path.expanduser("~"), ".mutagen-helper")), "db.json")
+def _paths(path):
+    return list(path) if isinstance(path, (list, tuple)) else [path]
 
 
 class ManagerInternals:
-    def __init__(self):
+    # Most session identifiers given to a single mutagen control command.
+    control_batch_size = 100
+
+    # Label holding the configuration hash of sessions, to recreate them when their configuration changes.
+    configuration_hash_label = 'config_hash'
+
+    # Format of plans, so apply refuses plans it doesn't understand.
+    plan_version = 1
+
+    # Compiled configuration of a directory, loaded instead of its configuration files while they're unchanged.
+    compiled_version = 1
+
+    _control_past_tenses = {'terminate': 'terminated', 'flush': 'flushed', 'pause': 'paused', 'resume': 'resumed'}
+
+    def __init__(self, cache=True, sessions_ttl=None, rescan=False):
         self.project_parser = ProjectParser()
         self.wrapper = MutagenWrapper()
+        self.configuration_cache = ConfigurationCache() if cache else None
+        self.discovery_index = DiscoveryIndex(rescan=rescan) if cache else None
+        self.load_compiled = cache and not rescan
+        self.session_index = SessionIndex() if cache else None
+        # Seconds a sessions listing is reused by following commands, unless sessions are changed meanwhile.
+        self.sessions_ttl = sessions_ttl
+        self._sessions = None
+        self._sessions_time = None
+        # Mutagen arguments of sessions, by session identity, dropped with their session.
+        self._arguments = dict()
 
     def _effective_beta(self, session, project_name):
         beta = session['beta']
@@ -24,6 +102,28 @@ class ManagerInternals:
             beta = beta + '/' + project_name
         return beta
 
+    def _beta_host(self, beta):
+        """
+        Host of a beta URL, or None for a local path.
+        """
+        if not beta:
+            return None
+        match = _docker_url_pattern.match(beta)
+        if match:
+            return 'docker://' + match.group('host')
+        match = _remote_url_pattern.match(beta)
+        if match:
+            return match.group('host')
+        return None
+
+    def _add_host_limits(self, host, session, group_jobs, group_delays):
+        max_jobs = session.get('max_jobs_per_host', os.environ.get('MUTAGEN_HELPER_MAX_JOBS_PER_HOST'))
+        if max_jobs:
+            group_jobs[host] = min(int(max_jobs), group_jobs.get(host, int(max_jobs)))
+        ramp_up_delay = session.get('ramp_up_delay', os.environ.get('MUTAGEN_HELPER_RAMP_UP_DELAY'))
+        if ramp_up_delay:
+            group_delays[host] = max(float(ramp_up_delay), group_delays.get(host, 0.0))
+
     def _build_label_list(self, project_name, name=None, alpha=None, beta=None, selector=False):
         labels = []
         value_separator = "==" if selector else "="
@@ -40,166 +140,1010 @@ class ManagerInternals:
     def _build_label_selector(self, project_name, name=None, alpha=None, beta=None):
         return ','.join(self._build_label_list(project_name, name, alpha, beta, selector=True))
 
-    def _dispatch_project_files(self, path, dispatcher_function, dispatch_session=False, project_name=None,
-                                session_name=None, *args, **kwargs):
-        betas = dict()
-        for session_info in self.wrapper.list():
-            betas[os.path.abspath(os.path.normpath(session_info['Beta']['URL']))] = session_info
+    def _find_one(self, snapshot, project_name, name):
+        session_infos = snapshot.find(project_name, name)
+        if len(session_infos) > 1:
+            raise MultipleSessionsException("Many sessions found for %s[%s]: %s" % (
+                project_name, name, ', '.join(map(session_identifier, session_infos))), result=None)
+        return session_infos[0] if session_infos else None
+
+    def _load_project_files(self, path):
+        """
+        Discover and parse configuration files, so each one is read once per command.
+
+        :return: list of (configuration file, parsed projects) tuples
+        """
+        project_files = []
+        paths = []
+        for item in _paths(path):
+            compiled = self._load_compiled(item) if self.load_compiled else None
+            if compiled is None:
+                paths.append(item)
+            else:
+                project_files.extend(compiled)
+        if paths:
+            project_files.extend((project_file, self._load_project_file(project_file))
+                                 for project_file in self._configuration_files(paths))
+
+        if self.configuration_cache:
+            self.configuration_cache.save()
+        if self.discovery_index:
+            self.discovery_index.save()
+        return project_files
+
+    def _compiled_file(self, path):
+        """
+        Compiled file of a directory, kept in mutagen-helper home directory so it's never synchronized.
+        """
+        root = os.path.normcase(os.path.abspath(path))
+        return os.path.join(home_path(), 'compiled', hashlib.sha1(root.encode('utf-8')).hexdigest() + '.json')
+
+    def compile(self, path):
+        """
+        Writes projects of configuration files found in each directory of path to a compiled file of this directory.
+
+        Compiled files are loaded instead of discovering and parsing configuration files, as long as stats of
+        configuration files and directories read to make them, and referenced environment variables are unchanged.
+
+        :return: compiled files
+        """
+        compiled_files = []
+        for item in _paths(path):
+            if not os.path.isdir(item):
+                raise ClickException('%s is not a directory, it can\'t be compiled.' % item)
+            root = os.path.abspath(item)
+            depth = scanner.discovery_depth()
+            prune = scanner.discovery_prune()
+            # Records directories read by discovery.
+            index = DiscoveryIndex(rescan=True)
+            files = set()
+            directories = set()
+            variables = set()
+            project_files = []
+            for project_file in scanner.configuration_files(root, depth, prune, index=index):
+                with self.project_parser.track() as tracker:
+                    projects = list(self.project_parser.parse(project_file))
+                files.update(tracker.files)
+                directories.update(tracker.directories)
+                variables.update(tracker.variables)
+                project_files.append((os.path.relpath(project_file, root), projects))
+            directories.update(index.entries)
+
+            compiled_file = self._compiled_file(root)
+            try:
+                content = json.dumps({
+                    'version': self.compiled_version,
+                    'root': os.path.normcase(root),
+                    'depth': depth,
+                    'prune': prune,
+                    'files': {source: _stat(source) for source in files},
+                    'directories': {source: _stat(source, directory=True) for source in directories},
+                    'variables': sorted(variables),
+                    'variables_hash': _variables_hash(variables),
+                    'project_files': project_files
+                }, separators=(',', ':'))
+            except (TypeError, ValueError) as e:
+                raise ClickException('Configuration of %s can\'t be compiled: %s' % (item, e))
+            os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+            fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(compiled_file), prefix='.compiled-',
+                                                suffix='.json')
+            try:
+                with os.fdopen(fd, 'w') as stream:
+                    stream.write(content)
+                os.replace(tmp_filepath, compiled_file)
+            except BaseException:
+                os.unlink(tmp_filepath)
+                raise
+            logging.info('Configuration of %s compiled to %s.' % (item, compiled_file))
+            compiled_files.append(compiled_file)
+        return compiled_files
+
+    def _load_compiled(self, path):
+        """
+        :return: list of (configuration file, parsed projects) tuples of a compiled file, or None if there's no
+        compiled file for this directory or if it's outdated
+        """
+        compiled_file = self._compiled_file(path)
+        try:
+            with open(compiled_file, 'r') as stream:
+                data = json.load(stream)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('root') != os.path.normcase(os.path.abspath(path)):
+            return None
+        if data.get('version') != self.compiled_version or data.get('depth') != scanner.discovery_depth() \
+                or data.get('prune') != scanner.discovery_prune():
+            logging.debug('Compiled configuration %s is outdated.' % compiled_file)
+            return None
+        sources = [(source, _stat(source) != stat) for source, stat in data['files'].items()] + \
+            [(source, _stat(source, directory=True) != stat) for source, stat in data['directories'].items()]
+        for source, changed in sources:
+            if changed:
+                logging.debug('Compiled configuration %s is outdated, %s has changed.' % (compiled_file, source))
+                return None
+        if _variables_hash(data['variables']) != data['variables_hash']:
+            logging.debug('Compiled configuration %s is outdated, environment variables have changed.'
+                          % compiled_file)
+            return None
+
+        logging.debug('Compiled configuration %s loaded.' % compiled_file)
+        return [(os.path.join(path, project_file), [Project.from_dict(project) for project in projects])
+                for project_file, projects in data['project_files']]
+
+    def _configuration_files(self, path):
+        """
+        Configuration files of a path, or of a list of paths discovered concurrently.
+        """
+        paths = _paths(path)
+        if len(paths) == 1:
+            return list(scanner.configuration_files(paths[0], index=self.discovery_index))
+
+        with ThreadPoolExecutor(min(scanner.discovery_jobs, len(paths))) as pool:
+            discovered = list(pool.map(
+                lambda item: list(scanner.configuration_files(item, index=self.discovery_index)), paths))
+        configuration_files = []
+        found = set()
+        for project_file in (project_file for project_files in discovered for project_file in project_files):
+            if os.path.abspath(project_file) not in found:
+                found.add(os.path.abspath(project_file))
+                configuration_files.append(project_file)
+        return configuration_files
+
+    def _load_project_file(self, project_file):
+        projects = self.configuration_cache.get(project_file) if self.configuration_cache else None
+        if projects is None:
+            with self.project_parser.track() as tracker:
+                projects = list(self.project_parser.load(project_file))
+            if self.configuration_cache:
+                self.configuration_cache.put(project_file, [project.to_dict() for project in projects], tracker)
+        else:
+            logging.debug('Configuration %s loaded from cache.' % project_file)
+            projects = [Project.from_dict(project) for project in projects]
+        return projects
+
+    def _list_sessions(self, long=False):
+        sessions = self._cached_sessions(long)
+        if sessions is not None:
+            return sessions
+        sessions = self.wrapper.list(long=long)
+        self._cache_sessions(sessions, long)
+        if self.session_index:
+            self.session_index.refresh(sessions)
+        return sessions
+
+    def _cached_sessions(self, long=False):
+        if self._sessions is None or self._sessions[0] != long \
+                or time.monotonic() - self._sessions_time > self.sessions_ttl:
+            return None
+        logging.debug('Sessions listed %.1f seconds ago are reused.' % (time.monotonic() - self._sessions_time))
+        return list(self._sessions[1])
 
-        for project_file in scanner.configuration_files(path):
-            for project in self.project_parser.parse(project_file):
+    def _cache_sessions(self, sessions, long=False):
+        if self.sessions_ttl:
+            self._sessions = (long, list(sessions))
+            self._sessions_time = time.monotonic()
+
+    def _invalidate_sessions(self):
+        self._sessions = None
+
+    def _project_files_betas(self, project_files, betas):
+        for project_file, projects in project_files:
+            for project in projects:
                 for project_session in project['sessions']:
                     betas[os.path.abspath(
                         os.path.normpath(
                             self._effective_beta(project_session, project['project_name'])))] = project_session
+        return betas
 
-        ret = []
-        for project_file in scanner.configuration_files(path):
+    def _iter_targets(self, project_files, betas, dispatch_session, project_name=None, session_name=None):
+        """
+        Yields (project, session) tuples to handle, session being None when the whole project should be handled.
+        """
+        dispatched = set()
+        for project_file, projects in project_files:
             project_dirname = os.path.abspath(os.path.dirname(os.path.normpath((project_file))))
-            for project in self.project_parser.parse(project_file):
+            for project in projects:
                 if not project_name or project_name == project['project_name']:
                     if dispatch_session or session_name:
                         for project_session in project['sessions']:
                             if not session_name or session_name == project_session['name']:
                                 beta_counterpart = betas.get(project_dirname)
                                 if beta_counterpart:
+                                    labels = session_labels(beta_counterpart) or beta_counterpart
                                     logging.debug("Skip file %s because it match beta of session %s (%s)." % (
-                                        project_file, beta_counterpart['project_name'], beta_counterpart['name']))
+                                        project_file, labels.get('project_name'), labels.get('name')))
                                     continue
-                                dispatcher_ret = dispatcher_function(project['project_name'], project_session,
-                                                                     *args, **kwargs)
-                                if dispatcher_ret is not None:
-                                    ret.append(dispatcher_ret)
+                                key = (project['project_name'], project_session['name'])
+                                if key in dispatched:
+                                    continue
+                                dispatched.add(key)
+                                yield project, project_session
                     else:
-                        dispatcher_ret = dispatcher_function(project['project_name'], *args, **kwargs)
-                        if dispatcher_ret:
-                            ret.extend(dispatcher_ret)
+                        if project['project_name'] in dispatched:
+                            continue
+                        dispatched.add(project['project_name'])
+                        yield project, None
 
-        return ret
+    def _dispatch_project_files(self, path, dispatcher_function, dispatch_session=False, project_name=None,
+                                session_name=None, long=False, jobs=1, *args, **kwargs):
+        try:
+            snapshot = SessionSnapshot(self._list_sessions(long=long))
+            project_files = self._load_project_files(path)
+            betas = self._project_files_betas(project_files, snapshot.betas())
+
+            tasks = []
+            group_jobs = {}
+            group_delays = {}
+            for project, project_session in self._iter_targets(project_files, betas, dispatch_session,
+                                                               project_name, session_name):
+                project_sessions = [project_session] if project_session else project['sessions']
+                hosts = set(self._beta_host(self._effective_beta(s, project['project_name']))
+                            for s in project_sessions)
+                host = hosts.pop() if len(hosts) == 1 else None
+                if host:
+                    for s in project_sessions:
+                        self._add_host_limits(host, s, group_jobs, group_delays)
+                if project_session:
+                    tasks.append(Task(dispatcher_function, project['project_name'], project_session, *args,
+                                      snapshot=snapshot, name='%s[%s]' % (project['project_name'],
+                                                                          project_session['name']),
+                                      group=host, **kwargs))
+                else:
+                    tasks.append(Task(dispatcher_function, project['project_name'], *args, snapshot=snapshot,
+                                      name=project['project_name'], group=host, **kwargs))
+
+            ret = []
+            for dispatcher_ret in TaskExecutor(jobs, group_jobs, group_delays).run(tasks):
+                if dispatch_session or session_name:
+                    if dispatcher_ret is not None:
+                        ret.append(dispatcher_ret)
+                elif dispatcher_ret:
+                    ret.extend(dispatcher_ret)
+
+            return ret
+        finally:
+            if self.session_index:
+                self.session_index.save()
 
-    def up(self, path, project_name=None, session_name=None):
-        return self._dispatch_project_files(path, self.up_handler, dispatch_session=True, project_name=project_name,
-                                            session_name=session_name)
+    def up(self, path, project_name=None, session_name=None, jobs=1):
+        return self._dispatch_project_files(path, self.up_handler, jobs=jobs, dispatch_session=True,
+                                            project_name=project_name, session_name=session_name)
 
-    def up_handler(self, project_name, session):
+    def up_handler(self, project_name, session, snapshot):
         name = session['name']
 
-        session_info = self.wrapper.list(label_selector=self._build_label_selector(project_name, session['name']),
-                                         one=True)
-        if session_info:
-            # Mutagen 0.9 use Session, but Mutagen 0.10+ use identifier.
+        alpha, beta, options = self._create_arguments(project_name, session)
+        session_info = self._find_one(snapshot, project_name, name)
+        if session_info and not self._drifted(session_info, options):
             logging.info('Session %s[%s] (%s) already exists.'
-                         % (project_name, name,
-                            session_info['Identifier'] if 'Identifier' in session_info else session_info['Session']))
+                         % (project_name, name, session_identifier(session_info)))
             return
+        elif session_info:
+            logging.info('Session %s[%s] (%s) configuration has changed, recreating it.'
+                         % (project_name, name, session_identifier(session_info)))
+            self._invalidate_sessions()
+            self._discard_sessions(self.wrapper.terminate(session_id=session_identifier(session_info)), snapshot)
         else:
             logging.debug('No session %s[%s] found.' % (name, project_name))
 
+        self._invalidate_sessions()
+        session_id = self.wrapper.create(alpha, beta, options)
+        logging.info('Session %s[%s] (%s) created.' % (project_name, name, session_id))
+        if self.session_index:
+            self.session_index.add(project_name, name, session_id)
+
+        return session_id
+
+    def _create_arguments(self, project_name, session):
+        """
+        :return: alpha, beta and options tuple to create the mutagen session, built once per session
+        """
+        key = id(session)
+        cached = self._arguments.get(key)
+        if cached is not None and cached[0]() is session and cached[1] == project_name:
+            return cached[2]
+        arguments = self._build_arguments(project_name, session)
+        try:
+            reference = weakref.ref(session, lambda _: self._arguments.pop(key, None))
+        except TypeError:
+            # Plain dict sessions can't be referenced weakly, their arguments are built each time.
+            return arguments
+        self._arguments[key] = (reference, project_name, arguments)
+        return arguments
+
+    def _build_arguments(self, project_name, session):
         alpha = session['alpha']
         beta = self._effective_beta(session, project_name)
-        options = copy.deepcopy(session.get('options', {}))
-        if 'label' not in options:
-            options['label'] = self._build_label_list(project_name, session['name'])
+        # Options are shared with other sessions, only the label list is changed.
+        options = dict(session.get('options', {}))
+        labels = self._build_label_list(project_name, session['name'])
+        labels.append('%s=%s' % (self.configuration_hash_label, self._configuration_hash(alpha, beta, options)))
+        label = options.get('label')
+        if isinstance(label, str):
+            label = [label]
+        options['label'] = list(label) + labels if label else labels
+        return alpha, beta, options
+
+    def _configuration_hash(self, alpha, beta, options):
+        """
+        Stable hash of what a session is created from.
+        """
+        if alpha and not self._beta_host(alpha):
+            # Same hash whatever the working directory a local alpha has been resolved from.
+            alpha = os.path.abspath(alpha)
+        data = json.dumps([alpha, beta, options], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _drifted(self, session_info, options):
+        """
+        Tells if an existing session was created from another configuration than creation options.
+
+        Sessions without configuration hash label, created by older versions, are considered up to date.
+        """
+        configuration_hash = session_labels(session_info).get(self.configuration_hash_label)
+        if not configuration_hash:
+            return False
+        return '%s=%s' % (self.configuration_hash_label, configuration_hash) not in options['label']
+
+    def _discard_sessions(self, session_ids, snapshot):
+        snapshot.discard(session_ids)
+        if self.session_index:
+            self.session_index.discard(session_ids)
+
+    def _control(self, path, command, project_name=None, session_name=None, jobs=1):
+        """
+        Runs a session control command (terminate, flush, pause or resume) on all targeted sessions at once.
+
+        Identifiers of all targets are gathered first, and given to as few mutagen invocations as possible.
+        """
+        try:
+            if self.session_index:
+                # Identifiers come from the session index, sessions are listed only if some are unknown or stale.
+                snapshot = SessionSnapshot(loader=self._list_sessions)
+            else:
+                snapshot = SessionSnapshot(self._list_sessions())
+            project_files = self._load_project_files(path)
+            betas = self._project_files_betas(project_files, snapshot.betas() if snapshot.loaded else dict())
+
+            targets = self._control_targets(project_files, betas, project_name, session_name)
+            return self._run_control(command, targets, snapshot, jobs)
+        finally:
+            self._invalidate_sessions()
+            if self.session_index:
+                self.session_index.save()
+
+    def _run_control(self, command, targets, snapshot, jobs=1):
+        """
+        Runs a session control command on sessions of (target, beta host) tuples.
+        """
+        resolved = []
+        for target, host in targets:
+            session_ids = self._target_session_ids(target, snapshot)
+            if session_ids:
+                resolved.append((target, session_ids, host))
+
+        tasks = [Task(self._control_batch, command, batch, snapshot, name=self._batch_name(batch), group=host)
+                 for host, batch in self._control_batches(resolved)]
+        return self._report_control(command, TaskExecutor(jobs).run(tasks))
+
+    def _control_targets(self, project_files, betas, project_name=None, session_name=None):
+        """
+        :return: list of ((project name, session name), beta host) tuples, session name being None for a whole
+        project, and beta host None if sessions are local or on many hosts.
+        """
+        targets = []
+        for project, project_session in self._iter_targets(project_files, betas, False, project_name, session_name):
+            project_sessions = [project_session] if project_session else project['sessions']
+            hosts = set(self._beta_host(self._effective_beta(s, project['project_name'])) for s in project_sessions)
+            targets.append(((project['project_name'], project_session['name'] if project_session else None),
+                            hosts.pop() if len(hosts) == 1 else None))
+        return targets
+
+    def _batch_name(self, batch):
+        return ', '.join(target[0] if target[1] is None else '%s[%s]' % target for target, _ in batch)
+
+    def _report_control(self, command, batch_results):
+        """
+        Logs sessions handled by control batches, and returns their identifiers.
+        """
+        ret = []
+        for batch_ret in batch_results:
+            for (target_project_name, _), session_ids in batch_ret:
+                for session_id in session_ids:
+                    logging.info('Session %s (%s) %s.' % (target_project_name, session_id,
+                                                          self._control_past_tenses[command]))
+                ret.extend(session_ids)
+
+        if command == 'terminate' and self.session_index:
+            self.session_index.discard(ret)
+        return ret
+
+    def _target_session_ids(self, target, snapshot, use_index=True):
+        """
+        Identifiers of sessions of a (project name, session name) target.
+
+        The session index may miss sessions created by another process, so it's only used for a single session, and
+        sessions of a whole project always come from the listing.
+        """
+        if use_index and self.session_index and target[1] is not None:
+            session_ids = self.session_index.find(*target)
+            if session_ids:
+                return session_ids
+        return [session_identifier(session_info) for session_info in snapshot.find(*target)]
+
+    def _control_batches(self, targets):
+        """
+        Yields (host, batch) tuples from (target, session identifiers, host) tuples.
+
+        A batch only holds targets of a single beta host, so an unreachable host doesn't hold back sessions of others.
+        """
+        host_targets = dict()
+        for target, session_ids, host in targets:
+            host_targets.setdefault(host, []).append((target, session_ids))
+
+        for host, targets in host_targets.items():
+            batch = []
+            size = 0
+            for target, session_ids in targets:
+                if batch and size + len(session_ids) > self.control_batch_size:
+                    yield host, batch
+                    batch = []
+                    size = 0
+                batch.append((target, session_ids))
+                size += len(session_ids)
+            if batch:
+                yield host, batch
+
+    def _control_batch(self, command, batch, snapshot):
+        control_function = getattr(self.wrapper, command)
+        try:
+            handled = self._run_control_batch(control_function, batch)
+        except SessionNotFoundException:
+            logging.debug('Some session identifiers are stale, looking for sessions with labels.')
+            batch = [(target, self._target_session_ids(target, snapshot, use_index=False)) for target, _ in batch]
+            batch = [(target, session_ids) for target, session_ids in batch if session_ids]
+            return self._run_control_batch(control_function, batch) if batch else []
+        return handled + self._control_missed(control_function, batch, handled, snapshot)
+
+    def _control_missed(self, control_function, batch, handled, snapshot):
+        """
+        Runs the control command on listed sessions of single session targets that didn't handle exactly one session,
+        as identifiers from the session index may be stale.
+        """
+        requested = set(self._batch_owners(batch))
+        handled_counts = dict((target, len(session_ids)) for target, session_ids in handled)
+        missed = []
+        for target, _ in batch:
+            if target[1] is not None and handled_counts.get(target, 0) != 1:
+                session_ids = [session_id for session_id in self._target_session_ids(target, snapshot, use_index=False)
+                               if session_id not in requested]
+                if session_ids:
+                    missed.append((target, session_ids))
+        return self._run_control_batch(control_function, missed) if missed else []
+
+    def _run_control_batch(self, control_function, batch):
+        """
+        Runs a single control command for all sessions of the batch, and maps reported identifiers back to targets.
+        """
+        owners = self._batch_owners(batch)
+        return self._batch_handled(batch, owners, control_function(session_id=list(owners)))
+
+    def _batch_owners(self, batch):
+        owners = dict()
+        for target, session_ids in batch:
+            for session_id in session_ids:
+                owners.setdefault(session_id, target)
+        return owners
+
+    def _batch_handled(self, batch, owners, handled_session_ids):
+        handled = dict((target, []) for target, _ in batch)
+        for session_id in handled_session_ids:
+            target = owners.get(session_id)
+            if target:
+                handled[target].append(session_id)
+            else:
+                logging.debug('Session %s was not requested.' % session_id)
+        return [(target, session_ids) for target, session_ids in handled.items() if session_ids]
+
+    def down(self, path, project_name=None, session_name=None, jobs=1):
+        return self._control(path, 'terminate', project_name=project_name, session_name=session_name, jobs=jobs)
+
+    def flush(self, path, project_name=None, session_name=None, jobs=1):
+        return self._control(path, 'flush', project_name=project_name, session_name=session_name, jobs=jobs)
+
+    def pause(self, path, project_name=None, session_name=None, jobs=1):
+        return self._control(path, 'pause', project_name=project_name, session_name=session_name, jobs=jobs)
+
+    def resume(self, path, project_name=None, session_name=None, jobs=1):
+        return self._control(path, 'resume', project_name=project_name, session_name=session_name, jobs=jobs)
+
+    def list(self, path, project_name=None, session_name=None, long=False, fields=None):
+        return list(self.iter_list(path, project_name=project_name, session_name=session_name, long=long,
+                                   fields=fields))
+
+    def iter_list(self, path, project_name=None, session_name=None, long=False, fields=None):
+        """
+        Yields sessions of configuration files while mutagen is listing them, in mutagen order.
+
+        :param fields: names of the only fields to keep in each session
+        """
+        project_files = self._load_project_files(path)
+        betas = self._project_files_betas(project_files, dict())
+        targets = dict()
+        for project, project_session in self._iter_targets(project_files, betas, True, project_name, session_name):
+            targets[(project['project_name'], project_session['name'])] = project_session
+
+        sessions = self._cached_sessions(long)
+        found = dict()
+        listed = []
+        listed_sessions = []
+        for session_info in sessions if sessions is not None else self.wrapper.iter_list(long=long):
+            if sessions is None and self.sessions_ttl:
+                listed_sessions.append(session_info)
+            labels = session_labels(session_info)
+            listed.append({'Identifier': session_identifier(session_info), 'Labels': labels})
+            key = (labels.get('project_name'), labels.get('name'))
+            project_session = targets.get(key)
+            if project_session is None:
+                continue
+            if key in found:
+                raise MultipleSessionsException("Many sessions found for %s[%s]: %s" % (
+                    key[0], key[1], ', '.join((found[key], session_identifier(session_info)))), result=None)
+            found[key] = session_identifier(session_info)
+            yield self._list_session(key[0], project_session, session_info, fields)
+
+        if sessions is None and self.sessions_ttl:
+            self._cache_sessions(listed_sessions, long)
+        if self.session_index:
+            self.session_index.refresh(listed)
+            self.session_index.save()
+
+    def _list_session(self, project_name, session, session_info, fields=None):
+        session_info = dict(session_info)
+        session_info['Mutagen Helper'] = {
+            'Project name': project_name,
+            'Session name': session.get('name'),
+            'Configuration file': session.get('configuration')
+        }
+        if fields:
+            session_info = dict((field, session_info[field]) for field in fields if field in session_info)
+        return session_info
+
+    def plan(self, path, project_name=None, session_name=None):
+        """
+        Compares sessions of configuration files with a single sessions listing, without changing anything.
+
+        :return: plan dict, with create, keep, recreate and terminate actions, and the number of mutagen invocations
+        required to apply them
+        """
+        try:
+            snapshot = SessionSnapshot(self._list_sessions())
+            project_files = self._load_project_files(path)
+            betas = self._project_files_betas(project_files, snapshot.betas())
+
+            actions = []
+            for project, project_session in self._iter_targets(project_files, betas, True, project_name,
+                                                               session_name):
+                actions.extend(self._plan_session(project['project_name'], project_session, snapshot))
+
+            configured = dict()
+            for _, projects in project_files:
+                for project in projects:
+                    if not project_name or project_name == project['project_name']:
+                        configured.setdefault(project['project_name'], set()).update(
+                            project_session['name'] for project_session in project['sessions'])
+            for configured_project_name, names in configured.items():
+                for session_info in snapshot.find(configured_project_name):
+                    name = session_labels(session_info).get('name')
+                    if name not in names and (not session_name or session_name == name):
+                        actions.append(self._plan_action('terminate', configured_project_name, name, session_info))
+
+            return {
+                'version': self.plan_version,
+                'path': path,
+                'actions': actions,
+                'summary': dict((action, len([a for a in actions if a['action'] == action]))
+                                for action in ('create', 'keep', 'recreate', 'terminate')),
+                'invocations': self._plan_invocations(actions)
+            }
+        finally:
+            if self.session_index:
+                self.session_index.save()
+
+    def _plan_session(self, project_name, session, snapshot):
+        alpha, beta, options = self._create_arguments(project_name, session)
+        session_infos = snapshot.find(project_name, session['name'])
+        if not session_infos:
+            action = self._plan_action('create', project_name, session['name'])
+        elif self._drifted(session_infos[0], options):
+            action = self._plan_action('recreate', project_name, session['name'], session_infos[0])
         else:
-            options['label'].extend(self._build_label_list(project_name, session['name']))
+            action = self._plan_action('keep', project_name, session['name'], session_infos[0])
 
-        session_id = self.wrapper.create(alpha, beta, options)
-        logging.info('Session %s[%s] (%s) created.' % (project_name, name, session_id))
+        if action['action'] != 'keep':
+            action.update({'alpha': alpha, 'beta': beta, 'options': options, 'host': self._beta_host(beta)})
+            for key in ('max_jobs_per_host', 'ramp_up_delay'):
+                if session.get(key) is not None:
+                    action[key] = session[key]
 
-        return session_id
+        # Extra sessions with the same labels are terminated.
+        return [action] + [self._plan_action('terminate', project_name, session['name'], session_info)
+                           for session_info in session_infos[1:]]
+
+    def _plan_action(self, action, project_name, name, session_info=None):
+        planned = {'action': action, 'project': project_name, 'session': name}
+        if session_info:
+            planned['identifier'] = session_identifier(session_info)
+            planned['config_hash'] = session_labels(session_info).get(self.configuration_hash_label)
+            if action == 'terminate':
+                beta = session_info.get('Beta')
+                planned['host'] = self._beta_host(beta.get('URL') if isinstance(beta, dict) else None)
+        return planned
+
+    def _plan_terminations(self, actions):
+        return [((action['project'], action['session']), [action['identifier']], action.get('host'))
+                for action in actions if action['action'] in ('terminate', 'recreate')]
+
+    def _plan_invocations(self, actions):
+        return len(list(self._control_batches(self._plan_terminations(actions)))) + \
+            len([action for action in actions if action['action'] in ('create', 'recreate')])
+
+    def apply(self, plan, jobs=1):
+        """
+        Runs a plan: sessions to terminate or recreate are terminated in batches, then sessions to create or recreate
+        are created. Sessions are listed once first, and actions made stale by sessions changed since the plan was
+        made are skipped, so applying a plan twice doesn't create sessions twice.
+
+        :return: identifiers of created sessions
+        """
+        if not isinstance(plan, dict) or plan.get('version') != self.plan_version:
+            raise PlanException('Invalid plan, make it again with mutagen-helper plan.')
+        try:
+            actions = self._current_actions(plan.get('actions', []), SessionSnapshot(self._list_sessions()))
+            tasks = [Task(self._apply_terminate_batch, batch, name=self._batch_name(batch), group=host)
+                     for host, batch in self._control_batches(self._plan_terminations(actions))]
+            self._report_control('terminate', TaskExecutor(jobs).run(tasks))
+            self._invalidate_sessions()
+
+            tasks = []
+            group_jobs = {}
+            group_delays = {}
+            for action in actions:
+                if action['action'] in ('create', 'recreate'):
+                    if action.get('host'):
+                        self._add_host_limits(action['host'], action, group_jobs, group_delays)
+                    tasks.append(Task(self._apply_create, action,
+                                      name='%s[%s]' % (action['project'], action['session']),
+                                      group=action.get('host')))
+            return TaskExecutor(jobs, group_jobs, group_delays).run(tasks)
+        finally:
+            self._invalidate_sessions()
+            if self.session_index:
+                self.session_index.save()
 
-    def down(self, path, project_name=None, session_name=None):
-        return self._dispatch_project_files(path, self.down_handler, project_name=project_name,
-                                            session_name=session_name)
-
-    def down_handler(self, project_name, session=None):
-        session_ids = self.wrapper.terminate(
-            label_selector=self._build_label_selector(project_name, name=session['name'] if session else None))
-        for session_id in session_ids:
-            logging.info('Session %s (%s) terminated.' % (project_name, session_id))
-        return session_ids
-
-    def flush(self, path, project_name=None, session_name=None):
-        return self._dispatch_project_files(path, self.flush_handler, project_name=project_name,
-                                            session_name=session_name)
-
-    def flush_handler(self, project_name, session=None):
-        session_ids = self.wrapper.flush(
-            label_selector=self._build_label_selector(project_name, name=session['name'] if session else None))
-        for session_id in session_ids:
-            logging.info('Session %s (%s) flushed.' % (project_name, session_id))
-        return session_ids
-
-    def pause(self, path, project_name=None, session_name=None):
-        return self._dispatch_project_files(path, self.pause_handler, project_name=project_name,
-                                            session_name=session_name)
-
-    def pause_handler(self, project_name, session=None):
-        session_ids = self.wrapper.pause(
-            label_selector=self._build_label_selector(project_name, name=session['name'] if session else None))
-        for session_id in session_ids:
-            logging.info('Session %s (%s) paused.' % (project_name, session_id))
-        return session_ids
-
-    def resume(self, path, project_name=None, session_name=None):
-        return self._dispatch_project_files(path, self.resume_handler, project_name=project_name,
-                                            session_name=session_name)
-
-    def resume_handler(self, project_name, session=None):
-        session_id = self.wrapper.resume(
-            label_selector=self._build_label_selector(project_name, name=session['name'] if session else None))
-        logging.info('Session %s (%s) resumed.' % (project_name, session_id))
+    def _current_actions(self, actions, snapshot):
+        """
+        Actions of a plan still matching listed sessions.
+
+        Sessions to terminate or recreate must still exist with the same configuration hash, and sessions to create or
+        recreate must not have other sessions than the ones terminated by the plan.
+        """
+        listed = dict((session_identifier(session_info), session_info) for session_info in snapshot.sessions)
+
+        def _unchanged(action):
+            session_info = listed.get(action.get('identifier'))
+            return session_info is not None and \
+                session_labels(session_info).get(self.configuration_hash_label) == action.get('config_hash')
+
+        terminated = set(action['identifier'] for action in actions
+                         if action['action'] in ('terminate', 'recreate') and _unchanged(action))
+        current = []
+        for action in actions:
+            if action['action'] in ('terminate', 'recreate') and not _unchanged(action):
+                stale = True
+            elif action['action'] in ('create', 'recreate'):
+                stale = any(session_identifier(session_info) not in terminated
+                            for session_info in snapshot.find(action['project'], action['session']))
+            else:
+                stale = False
+            if stale:
+                logging.warning('Session %s[%s] has changed since the plan was made, %s is skipped.'
+                                % (action['project'], action['session'], action['action']))
+            else:
+                current.append(action)
+        return current
+
+    def _apply_terminate_batch(self, batch):
+        try:
+            return self._run_control_batch(self.wrapper.terminate, batch)
+        except SessionNotFoundException:
+            logging.debug('Some sessions of the plan have vanished, listing sessions.')
+            existing = set(session_identifier(session_info) for session_info in self._list_sessions())
+            batch = [(target, [session_id for session_id in session_ids if session_id in existing])
+                     for target, session_ids in batch]
+            batch = [(target, session_ids) for target, session_ids in batch if session_ids]
+            return self._run_control_batch(self.wrapper.terminate, batch) if batch else []
+
+    def _apply_create(self, action):
+        session_id = self.wrapper.create(action['alpha'], action['beta'], action['options'])
+        logging.info('Session %s[%s] (%s) created.' % (action['project'], action['session'], session_id))
+        if self.session_index:
+            self.session_index.add(action['project'], action['session'], session_id)
         return session_id
 
-    def list(self, path, project_name=None, session_name=None, long=False):
-        return self._dispatch_project_files(path, self.list_handler, dispatch_session=True, project_name=project_name,
-                                            session_name=session_name, long=long)
-
-    def list_handler(self, project_name, session=None, long=False):
-        mutagen_session = self.wrapper.list(
-            label_selector=self._build_label_selector(project_name, name=session['name'] if session else None),
-            long=long,
-            one=True)
-        if mutagen_session:
-            mutagen_session['Mutagen Helper'] = {
-                'Project name': project_name,
-                'Session name': session.get('name'),
-                'Configuration file': session.get('configuration')
-            }
+    def gc(self, path, min_age=None, dry_run=False, jobs=1, force=False):
+        """
+        Terminates orphan sessions, created by mutagen-helper but not configured anymore.
+
+        A labelled session is orphan when it doesn't match any configured session, and either its project is still
+        configured, its alpha directory doesn't exist anymore, or discovery has read its alpha directory inside a path
+        and found no configuration file in it or its parents. With force, sessions with an alpha anywhere inside a path
+        are orphan too. When min_age is given, only orphans created at least min_age seconds ago are terminated.
+
+        :return: identifiers of orphan sessions, terminated unless dry_run
+        """
+        try:
+            snapshot = SessionSnapshot(self._list_sessions())
+            project_files = self._load_project_files(path)
+
+            configured = dict()
+            for _, projects in project_files:
+                for project in projects:
+                    configured.setdefault(project['project_name'], set()).update(
+                        project_session['name'] for project_session in project['sessions'])
+
+            roots = [os.path.normcase(os.path.abspath(item if os.path.isdir(item) else os.path.dirname(item)))
+                     for item in _paths(path)]
+            scanned = set(os.path.normcase(os.path.abspath(directory)) for root in roots
+                          for directory in scanner.discovery_directories(root))
+            configuration_directories = set(os.path.normcase(os.path.dirname(os.path.abspath(project_file)))
+                                            for project_file, _ in project_files)
+            creation_times = self.wrapper.creation_times() if min_age else None
+            now = time.time()
+            orphans = []
+            for session_info in snapshot.sessions:
+                labels = session_labels(session_info)
+                key = (labels.get('project_name'), labels.get('name'))
+                if not key[0] or not key[1] or key[1] in configured.get(key[0], ()):
+                    continue
+                if key[0] not in configured and not self._orphan_alpha(
+                        session_info, roots, scanned, configuration_directories, force):
+                    continue
+                if min_age:
+                    created = _creation_timestamp(creation_times.get(session_identifier(session_info)))
+                    if created is None:
+                        logging.warning('Creation time of session %s[%s] (%s) is unknown, it is not terminated.'
+                                        % (key[0], key[1], session_identifier(session_info)))
+                        continue
+                    if now - created < min_age:
+                        logging.debug('Session %s[%s] (%s) is not old enough to be terminated.'
+                                      % (key[0], key[1], session_identifier(session_info)))
+                        continue
+                orphans.append((key, session_info))
+
+            if dry_run:
+                for key, session_info in orphans:
+                    logging.info('Session %s[%s] (%s) is orphan.' % (key[0], key[1], session_identifier(session_info)))
+                return [session_identifier(session_info) for _, session_info in orphans]
+
+            targets = [(key, [session_identifier(session_info)], None) for key, session_info in orphans]
+            tasks = [Task(self._control_batch, 'terminate', batch, snapshot, name=self._batch_name(batch))
+                     for _, batch in self._control_batches(targets)]
+            return self._report_control('terminate', TaskExecutor(jobs).run(tasks))
+        finally:
+            self._invalidate_sessions()
+            if self.session_index:
+                self.session_index.save()
+
+    def _orphan_alpha(self, session_info, roots, scanned, configuration_directories, force=False):
+        """
+        Tells if the local alpha of a session doesn't exist anymore, or if it's a directory discovery has read inside
+        one of roots, without configuration file in it or its parents up to the root.
+
+        Discovery doesn't read directories deeper than its depth or pruned ones, their sessions are only orphan with
+        force.
+        """
+        alpha = session_info.get('Alpha')
+        url = alpha.get('URL') if isinstance(alpha, dict) else None
+        if not url or self._beta_host(url):
+            return False
+        if not os.path.isdir(url):
+            return True
+        alpha_path = os.path.normcase(os.path.abspath(url))
+        containing_roots = [root for root in roots
+                            if alpha_path == root or alpha_path.startswith(root.rstrip(os.sep) + os.sep)]
+        if not containing_roots:
+            return False
+        if force:
+            return True
+        if alpha_path not in scanned:
+            return False
+        root = min(containing_roots, key=len)
+        directory = alpha_path
+        while directory not in configuration_directories:
+            if directory == root:
+                return True
+            directory = os.path.dirname(directory)
+        return False
+
+    def watch(self, path, watcher, debounce=0.5, jobs=1):
+        """
+        Creates sessions of configuration files, then keeps sessions in line with configuration files as they change.
+
+        Only configuration files affected by a change are parsed again, and only sessions added, removed or changed
+        by those files are created, terminated or recreated.
+        """
+        self.up(path, jobs=jobs)
+        project_files = dict(self._load_project_files(path))
+        definitions = self._session_definitions(project_files)
+        logging.info('Watching configuration files of %s.' % ', '.join(watcher.roots))
+
+        for changed in watcher.changes(debounce):
+            logging.debug('Changed paths: %s' % ', '.join(sorted(changed)))
+            project_files = self._reload_project_files(path, project_files, changed)
+            new_definitions = self._session_definitions(project_files)
+            try:
+                self._reconcile(definitions, new_definitions, jobs)
+            except ClickException as e:
+                logging.error('Unable to apply configuration changes: %s' % e.format_message())
+            definitions = new_definitions
 
-        return mutagen_session
+    def _reload_project_files(self, path, project_files, changed):
+        """
+        Parses again configuration files with changed paths in their directory, and new configuration files.
+
+        A configuration file that can't be parsed anymore keeps its previous projects, so a typo doesn't terminate
+        its sessions.
+        """
+        reloaded = dict()
+        for project_file in self._configuration_files(path):
+            directory = os.path.dirname(os.path.abspath(project_file))
+            if project_file in project_files and not any(
+                    changed_path == directory or changed_path.startswith(directory + os.sep)
+                    for changed_path in changed):
+                reloaded[project_file] = project_files[project_file]
+                continue
+            try:
+                reloaded[project_file] = self._load_project_file(project_file)
+                logging.debug('Configuration %s loaded.' % project_file)
+            except Exception as e:
+                logging.error('Unable to load configuration %s: %s' % (project_file, e))
+                if project_file in project_files:
+                    reloaded[project_file] = project_files[project_file]
+
+        if self.configuration_cache:
+            self.configuration_cache.save()
+        if self.discovery_index:
+            self.discovery_index.save()
+        return reloaded
+
+    def _session_definitions(self, project_files):
+        """
+        :return: dict of (project name, session name) keys to (session, creation fingerprint, beta host) tuples
+        """
+        project_files = list(project_files.items())
+        betas = self._project_files_betas(project_files, dict())
+        definitions = dict()
+        for project, project_session in self._iter_targets(project_files, betas, True):
+            key = (project['project_name'], project_session['name'])
+            arguments = self._create_arguments(project['project_name'], project_session)
+            definitions[key] = (project_session, json.dumps(arguments, sort_keys=True, default=str),
+                                self._beta_host(arguments[1]))
+        return definitions
+
+    def _reconcile(self, definitions, new_definitions, jobs=1):
+        """
+        Terminates sessions removed from definitions, creates added ones, and recreates changed ones.
+        """
+        removed = [key for key in definitions if key not in new_definitions]
+        changed = [key for key in new_definitions if key in definitions and
+                   definitions[key][1] != new_definitions[key][1]]
+        added = [key for key in new_definitions if key not in definitions]
+        if not removed and not changed and not added:
+            logging.debug('Sessions are unchanged.')
+            return
+
+        try:
+            snapshot = SessionSnapshot(loader=self._list_sessions)
+            for key in changed:
+                logging.info('Session %s[%s] has changed, recreating it.' % key)
+            terminated = self._run_control('terminate', [(key, definitions[key][2]) for key in removed + changed],
+                                           snapshot, jobs)
+            self._invalidate_sessions()
+            if snapshot.loaded:
+                snapshot.discard(terminated)
+
+            tasks = []
+            group_jobs = {}
+            group_delays = {}
+            for key in changed + added:
+                project_session, _, host = new_definitions[key]
+                if host:
+                    self._add_host_limits(host, project_session, group_jobs, group_delays)
+                tasks.append(Task(self.up_handler, key[0], project_session, snapshot=snapshot,
+                                  name='%s[%s]' % key, group=host))
+            TaskExecutor(jobs, group_jobs, group_delays).run(tasks)
+        finally:
+            self._invalidate_sessions()
+            if self.session_index:
+                self.session_index.save()
 
 
 class Manager:
-    def __init__(self):
-        self._internals = ManagerInternals()
+    def __init__(self, cache=True, sessions_ttl=None, rescan=False):
+        self._internals = ManagerInternals(cache=cache, sessions_ttl=sessions_ttl, rescan=rescan)
 
     def _sanitize_path(self, path):
-        if path:
-            return path
-        else:
-            return os.environ.get('MUTAGEN_HELPER_PATH', os.getcwd())
+        return sanitize_path(path)
+
+    def up(self, path=None, project=None, session=None, jobs=1):
+        return self._internals.up(self._sanitize_path(path), project_name=project, session_name=session,
+                                  jobs=jobs)
+
+    def down(self, path=None, project=None, session=None, jobs=1):
+        return self._internals.down(self._sanitize_path(path), project_name=project, session_name=session,
+                                    jobs=jobs)
+
+    def resume(self, path=None, project=None, session=None, jobs=1):
+        return self._internals.resume(self._sanitize_path(path), project_name=project, session_name=session,
+                                      jobs=jobs)
+
+    def pause(self, path=None, project=None, session=None, jobs=1):
+        return self._internals.pause(self._sanitize_path(path), project_name=project, session_name=session,
+                                     jobs=jobs)
+
+    def list(self, path=None, project=None, session=None, long=False, fields=None):
+        return self._internals.list(self._sanitize_path(path), project_name=project, session_name=session, long=long,
+                                    fields=fields)
+
+    def iter_list(self, path=None, project=None, session=None, long=False, fields=None):
+        return self._internals.iter_list(self._sanitize_path(path), project_name=project, session_name=session,
+                                         long=long, fields=fields)
+
+    def flush(self, path=None, project=None, session=None, jobs=1):
+        return self._internals.flush(self._sanitize_path(path), project_name=project, session_name=session,
+                                     jobs=jobs)
+
+    def plan(self, path=None, project=None, session=None):
+        return self._internals.plan(self._sanitize_path(path), project_name=project, session_name=session)
+
+    def apply(self, plan, jobs=1):
+        return self._internals.apply(plan, jobs=jobs)
 
-    def up(self, path=None, project=None, session=None):
-        return self._internals.up(self._sanitize_path(path), project_name=project, session_name=session)
+    def compile(self, path=None):
+        return self._internals.compile(self._sanitize_path(path))
 
-    def down(self, path=None, project=None, session=None):
-        return self._internals.down(self._sanitize_path(path), project_name=project, session_name=session)
+    def gc(self, path=None, min_age=None, dry_run=False, jobs=1, force=False):
+        return self._internals.gc(self._sanitize_path(path), min_age=min_age, dry_run=dry_run, jobs=jobs,
+                                  force=force)
 
-    def resume(self, path=None, project=None, session=None):
-        return self._internals.resume(self._sanitize_path(path), project_name=project, session_name=session)
+    def watch(self, path=None, jobs=1, debounce=0.5, interval=None):
+        """
+        Keeps sessions in line with configuration files until interrupted.
 
-    def pause(self, path=None, project=None, session=None):
-        return self._internals.pause(self._sanitize_path(path), project_name=project, session_name=session)
+        Configuration files are watched with inotify, or polled every interval seconds when inotify is not available
+        or an interval is given.
+        """
+        from .watcher import create_watcher
 
-    def list(self, path=None, project=None, session=None, long=False):
-        return self._internals.list(self._sanitize_path(path), project_name=project, session_name=session, long=long)
+        path = self._sanitize_path(path)
+        watcher = create_watcher(path, interval)
+        try:
+            self._internals.watch(path, watcher, debounce=debounce, jobs=jobs)
+        finally:
+            watcher.close()
 
-    def flush(self, path=None, project=None, session=None):
-        return self._internals.flush(self._sanitize_path(path), project_name=project, session_name=session)
+    def clear_cache(self):
+        (self._internals.configuration_cache or ConfigurationCache()).clear()
+        (self._internals.discovery_index or DiscoveryIndex()).clear()
 
     def project_files(self, path):
-        return scanner.configuration_files(self._sanitize_path(path))
+        return self._internals._configuration_files(self._sanitize_path(path))
 
     def project_file(self, path):
-        return scanner.configuration_file(self._sanitize_path(path))
+        for item in _paths(self._sanitize_path(path)):
+            project_file = scanner.configuration_file(item)
+            if project_file:
+                return project_file
+        return None
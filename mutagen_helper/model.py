@@ -0,0 +1,116 @@
+"""
+Parsed configuration, as read-only projects and sessions.
+
+Sessions don't copy values inherited from their project, they look them up in the project values they share by
+reference. Both are mappings with the keys of configuration dicts, and to_dict converts them back to plain dicts.
+"""
+import copy
+from abc import abstractmethod
+from collections.abc import Mapping
+
+# Project keys sessions don't inherit.
+_not_inherited = ('sessions', 'auto_configure')
+
+
+class _Immutable(Mapping):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable.' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable.' % type(self).__name__)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+    @abstractmethod
+    def to_dict(self):
+        pass
+
+
+class Session(_Immutable):
+    """
+    Session of a project, with its own values and values inherited from the project.
+    """
+    # Weak references let the manager keep mutagen arguments of sessions without keeping sessions alive.
+    __slots__ = ('_values', '_inherited', '__weakref__')
+
+    def __init__(self, values, inherited=None):
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_inherited', inherited if inherited is not None else {})
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in _not_inherited:
+            return self._inherited[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._values or (key not in _not_inherited and key in self._inherited)
+
+    def __iter__(self):
+        yield from self._values
+        for key in self._inherited:
+            if key not in self._values and key not in _not_inherited:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return copy.deepcopy(dict(self.items()))
+
+
+class Project(_Immutable):
+    """
+    Project values, and its sessions sharing them.
+    """
+    __slots__ = ('_values', '_sessions')
+
+    def __init__(self, values, sessions=None):
+        """
+        :param values: project values, without sessions
+        :param sessions: own values of each session
+        """
+        if sessions is None:
+            sessions = [{}]
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_sessions', tuple(Session(session, values) for session in sessions))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Project of a configuration dict, session values equal to project ones being shared again.
+        """
+        values = dict((k, v) for k, v in data.items() if k != 'sessions')
+        sessions = []
+        for session in data.get('sessions', [{}]):
+            sessions.append(dict((k, v) for k, v in session.items()
+                                 if k in _not_inherited or k not in values or values[k] != v))
+        return cls(values, sessions)
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+    def __getitem__(self, key):
+        if key == 'sessions':
+            return self._sessions
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key == 'sessions' or key in self._values
+
+    def __iter__(self):
+        yield from self._values
+        yield 'sessions'
+
+    def __len__(self):
+        return len(self._values) + 1
+
+    def to_dict(self):
+        data = copy.deepcopy(self._values)
+        data['sessions'] = [session.to_dict() for session in self._sessions]
+        return data
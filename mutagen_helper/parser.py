@@ -1,30 +1,68 @@
 import os
+import re
+from contextlib import contextmanager
 
 import yaml
 from expandvars import expandvars
 
 from mutagen_helper import scanner
+from .model import Project
+
+
+_variable_pattern = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)')
+
+default_variables = ('MUTAGEN_HELPER_ALPHA', 'MUTAGEN_HELPER_BETA', 'MUTAGEN_HELPER_APPEND_PROJECT_NAME_TO_BETA')
+
+# libyaml loader is much faster, when PyYAML has been built with it.
+_yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class ParseTracker:
+    """
+    Files, directories and environment variables some parsed configuration depends on.
+    """
+
+    def __init__(self):
+        self.files = set()
+        self.directories = set()
+        self.variables = set(default_variables)
 
 
 class ProjectParser:
+    def __init__(self):
+        self.tracker = None
+
+    @contextmanager
+    def track(self):
+        """
+        Record dependencies of configuration files parsed inside this context.
+        """
+        self.tracker = ParseTracker()
+        try:
+            yield self.tracker
+        finally:
+            self.tracker = None
+
     def handle_project_inheritance(self, project):
+        """
+        Copies values of a project dict into its session dicts, the way Project sessions inherit them.
+        """
         if 'sessions' not in project:
-            session = {}
-            project['sessions'] = [session]
-        for k, v in project.items():
-            if k in ('sessions', 'auto_configure'):
-                continue
-            for session in project['sessions']:
-                if k not in session:
-                    session[k] = v
+            project['sessions'] = [{}]
+        values = dict((k, v) for k, v in project.items() if k != 'sessions')
+        for session, inheriting in zip(project['sessions'], Project(values, project['sessions']).sessions):
+            session.update(dict(inheriting))
 
     def handle_data_inheritance(self, data):
-        for k, v in data.items():
-            if k in ('projects', 'auto_configure'):
-                continue
+        """
+        Copies values of configuration data into its project dicts, the way parse_project inherits them.
+        """
+        for k, v in self._inherited_values(data).items():
             for project in data['projects']:
-                if k not in project:
-                    project[k] = v
+                project.setdefault(k, v)
+
+    def _inherited_values(self, data):
+        return dict((k, v) for k, v in data.items() if k not in ('projects', 'auto_configure'))
 
     def expandvars(self, data):
         if isinstance(data, dict):
@@ -56,15 +94,31 @@ class ProjectParser:
         for i, session in enumerate(data['sessions']):
             session['name'] = session.get('name', str(i))
 
-    def parse_project(self, project: dict, path=None):
-        self.add_project_default_values(project, path=path)
-        self.handle_project_inheritance(project)
-        self.add_project_sessions_default_values(project)
-        project = self.expandvars(project)
-        return project
+    def parse_project(self, project: dict, path=None, inherited=None):
+        """
+        :param inherited: tuple of data values inherited by the project, and their expanded values shared by all
+        projects of data
+        """
+        inherited_values, inherited_expanded = inherited or ({}, {})
+        values = dict(inherited_values)
+        values.update(project)
+        self.add_project_default_values(values, path=path)
+        sessions = values.pop('sessions', [{}])
+        values = dict((k, inherited_expanded[k] if k in inherited_values and v is inherited_values[k]
+                       else self.expandvars(v)) for k, v in values.items())
+
+        sessions_values = []
+        for i, session in enumerate(sessions):
+            session = dict(session)
+            if 'name' not in session and 'name' not in values:
+                session['name'] = str(i)
+            sessions_values.append(self.expandvars(session))
+        return Project(values, sessions_values)
 
     def parse_data(self, data: dict, path=None):
         if data.get('auto_configure'):
+            if self.tracker is not None:
+                self._track_directory(path)
             auto_configured_projects = list(scanner.auto_configure(path, data.get('auto_configure'), self))
             if auto_configured_projects:
                 if 'projects' not in data:
@@ -77,14 +131,37 @@ class ProjectParser:
 
         if 'projects' in data:
             data['configuration'] = path
-            self.handle_data_inheritance(data)
+            inherited_values = self._inherited_values(data)
+            inherited = (inherited_values, self.expandvars(inherited_values))
             for project in data['projects']:
-                yield self.parse_project(project, path)
+                yield self.parse_project(project, path, inherited)
         else:
             data['configuration'] = path
             yield self.parse_project(data, path)
 
+    def _track_directory(self, path):
+        directory = os.path.dirname(path) if os.path.isfile(path) else path
+        self.tracker.directories.add(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.tracker.directories.add(entry.path)
+
     def parse(self, configuration_filepath: str):
+        """
+        Projects of a configuration file, as dicts.
+        """
+        for project in self.load(configuration_filepath):
+            yield project.to_dict()
+
+    def load(self, configuration_filepath: str):
+        """
+        Projects of a configuration file, as Project instances sharing inherited values with their sessions.
+        """
         with open(configuration_filepath, 'r') as stream:
-            data = yaml.safe_load(stream)
+            content = stream.read()
+        if self.tracker is not None:
+            self.tracker.files.add(configuration_filepath)
+            self.tracker.variables.update(_variable_pattern.findall(content))
+        data = yaml.load(content, Loader=_yaml_loader)
         return self.parse_data(data, configuration_filepath)
@@ -1,9 +1,12 @@
 import fnmatch
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 from click import ClickException
 
-from mutagen_helper.parser import ProjectParser
+if TYPE_CHECKING:  # pragma: no cover
+    from mutagen_helper.parser import ProjectParser
 
 
 class ScannerException(ClickException):
@@ -14,31 +17,131 @@ class AutoConfigureNoProject(ScannerException):
     pass
 
 
+configuration_filenames = ['mutagen-helper.yml', 'mutagen-helper.yaml', '.mutagen-helper.yml', '.mutagen-helper.yaml']
+
+# Directory names not looked into for configuration files, unless MUTAGEN_HELPER_PRUNE is set.
+default_prune = ['.git', '.hg', '.svn', 'node_modules']
+
+# Most threads walking subdirectories at the same time.
+discovery_jobs = 16
+
+
 def configuration_file(path):
-    candidates = ['mutagen-helper.yml', 'mutagen-helper.yaml', '.mutagen-helper.yml', '.mutagen-helper.yaml']
-    for candidate in candidates:
+    for candidate in configuration_filenames:
         candidate_path = os.path.join(path, candidate)
         if os.path.isfile(os.path.join(path, candidate)):
             return candidate_path
     return None
 
 
-def configuration_files(path):
+def discovery_depth():
+    """
+    How many directory levels below a path are looked into for configuration files.
+    """
+    return int(os.environ.get('MUTAGEN_HELPER_DEPTH', 1))
+
+
+def discovery_prune():
+    """
+    Patterns of directory names which are never looked into for configuration files.
+    """
+    prune = os.environ.get('MUTAGEN_HELPER_PRUNE')
+    if prune is None:
+        return default_prune
+    return [pattern.strip() for pattern in prune.split(',') if pattern.strip()]
+
+
+def is_pruned(name, prune):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in prune)
+
+
+def _read_directory(path, prune):
+    """
+    Reads a directory with a single scandir.
+
+    :return: configuration filename of the directory or None, and names of its subdirectories which are not pruned
+    """
+    filenames = set()
+    directories = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name in configuration_filenames:
+                    if entry.is_file():
+                        filenames.add(entry.name)
+                elif entry.is_dir() and not is_pruned(entry.name, prune):
+                    directories.append(entry.name)
+    except OSError:
+        return None, []
+    for filename in configuration_filenames:
+        if filename in filenames:
+            return filename, directories
+    return None, directories
+
+
+def _scan_directory(path, prune, index=None):
+    """
+    :return: configuration file of the directory or None, and its subdirectories which are not pruned
+    """
+    if index is not None:
+        filename, directories = index.scan(path, prune, _read_directory)
+    else:
+        filename, directories = _read_directory(path, prune)
+    return os.path.join(path, filename) if filename else None, [os.path.join(path, name) for name in directories]
+
+
+def _discover(path, depth, prune, index=None):
+    """
+    Configuration file of a directory, or configuration files of its subdirectories down to depth levels.
+    """
+    filepath, directories = _scan_directory(path, prune, index)
+    if filepath:
+        return [filepath]
+    if depth <= 0:
+        return []
+    return [filepath for directory in directories for filepath in _discover(directory, depth - 1, prune, index)]
+
+
+def configuration_files(path, depth=None, prune=None, index=None):
+    """
+    Yields the configuration file of path if there's one, or configuration files found in its subdirectories.
+
+    Subdirectories are looked into down to depth levels (MUTAGEN_HELPER_DEPTH, 1 by default), skipping those matching
+    prune patterns (MUTAGEN_HELPER_PRUNE). A directory holding a configuration file is a project, so its own
+    subdirectories are not looked into. Each subdirectory of path is walked by a thread of a pool.
+
+    When a DiscoveryIndex is given, directories with an unchanged mtime are not read again.
+    """
     if os.path.isdir(path):
-        group_file = configuration_file(path)
+        depth = discovery_depth() if depth is None else depth
+        prune = discovery_prune() if prune is None else prune
+        group_file, directories = _scan_directory(path, prune, index)
         if group_file:
             yield group_file
-        else:
-            for item in os.listdir(path):
-                child_path = os.path.join(path, item)
-                if os.path.isdir(os.path.join(path, child_path)):
-                    child_project_file = configuration_file(child_path)
-                    if child_project_file:
-                        yield child_project_file
+        elif depth > 0 and len(directories) > 1:
+            with ThreadPoolExecutor(min(discovery_jobs, len(directories))) as pool:
+                for filepaths in pool.map(lambda directory: _discover(directory, depth - 1, prune, index),
+                                          directories):
+                    yield from filepaths
+        elif depth > 0:
+            for directory in directories:
+                yield from _discover(directory, depth - 1, prune, index)
     elif os.path.isfile(path):
         yield path
 
 
+def discovery_directories(path, depth=None, prune=None):
+    """
+    Yields directories configuration files may be looked into: path, and its subdirectories down to depth levels.
+    """
+    depth = discovery_depth() if depth is None else depth
+    prune = discovery_prune() if prune is None else prune
+    yield path
+    if depth > 0:
+        for directory in _scan_directory(path, prune)[1]:
+            yield from discovery_directories(directory, depth - 1, prune)
+
+
 def _path_matches(item, include=None, exclude=None):
     if include:
         if isinstance(include, bool):
@@ -58,7 +161,7 @@ def _path_matches(item, include=None, exclude=None):
     return True
 
 
-def auto_configure(path, auto=True, parser: ProjectParser = None):
+def auto_configure(path, auto=True, parser: 'ProjectParser' = None):
     if os.path.isfile(path):
         path = os.path.dirname(path)
 
@@ -0,0 +1,161 @@
+import os
+import threading
+
+from .db import Database
+
+
+def session_identifier(session_info):
+    # Mutagen 0.9 use Session, but Mutagen 0.10+ use identifier.
+    return session_info['Identifier'] if 'Identifier' in session_info else session_info.get('Session')
+
+
+def session_labels(session_info):
+    labels = session_info.get('Labels')
+    return labels if isinstance(labels, dict) else {}
+
+
+class SessionSnapshot:
+    """
+    In-memory index of a single mutagen sessions listing, keyed by mutagen-helper labels.
+
+    When a loader is given instead of sessions, the listing is only retrieved on first use.
+    """
+
+    def __init__(self, sessions=None, loader=None):
+        self._lock = threading.RLock()
+        self._loader = loader
+        self._sessions = []
+        self._by_project = {}
+        for session_info in sessions or []:
+            self._add(session_info)
+
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def _load(self):
+        with self._lock:
+            if self._loader is not None:
+                loader = self._loader
+                for session_info in loader():
+                    self._add(session_info)
+                self._loader = None
+
+    @property
+    def sessions(self):
+        self._load()
+        return self._sessions
+
+    def _add(self, session_info):
+        self._sessions.append(session_info)
+        labels = session_labels(session_info)
+        project_name = labels.get('project_name')
+        if project_name:
+            self._by_project.setdefault(project_name, []).append(session_info)
+
+    def add(self, session_info):
+        self._load()
+        with self._lock:
+            self._add(session_info)
+
+    def discard(self, session_ids):
+        session_ids = set(session_ids)
+        if not session_ids:
+            return
+        self._load()
+        with self._lock:
+            self._sessions = [s for s in self._sessions if session_identifier(s) not in session_ids]
+            for project_name, project_sessions in list(self._by_project.items()):
+                project_sessions = [s for s in project_sessions if session_identifier(s) not in session_ids]
+                if project_sessions:
+                    self._by_project[project_name] = project_sessions
+                else:
+                    del self._by_project[project_name]
+
+    def find(self, project_name, name=None):
+        self._load()
+        project_sessions = self._by_project.get(project_name, [])
+        if name is None:
+            return list(project_sessions)
+        return [s for s in project_sessions if session_labels(s).get('name') == name]
+
+    def betas(self):
+        betas = dict()
+        for session_info in self.sessions:
+            beta = session_info.get('Beta')
+            if isinstance(beta, dict) and beta.get('URL'):
+                betas[os.path.abspath(os.path.normpath(beta['URL']))] = session_info
+        return betas
+
+
+class SessionIndex:
+    """
+    Persistent index of mutagen session identifiers, by project and session names.
+
+    It's used to run control commands directly on known identifiers, without listing sessions first. It may be stale,
+    so it's refreshed from a snapshot each time one is available.
+    """
+    section = 'sessions'
+
+    def __init__(self, database=None):
+        self.database = database or Database()
+        self._lock = threading.RLock()
+        self._projects = None
+        self._dirty = False
+
+    @property
+    def projects(self):
+        with self._lock:
+            if self._projects is None:
+                self._projects = self.database.read(self.section)
+            return self._projects
+
+    def find(self, project_name, name=None):
+        with self._lock:
+            project_sessions = self.projects.get(project_name, {})
+            if name is None:
+                return [session_id for session_ids in project_sessions.values() for session_id in session_ids]
+            return list(project_sessions.get(name, []))
+
+    def add(self, project_name, name, session_id):
+        with self._lock:
+            session_ids = self.projects.setdefault(project_name, {}).setdefault(name, [])
+            if session_id not in session_ids:
+                session_ids.append(session_id)
+                self._dirty = True
+
+    def discard(self, session_ids):
+        session_ids = set(session_ids)
+        with self._lock:
+            for project_name, project_sessions in list(self.projects.items()):
+                for name, ids in list(project_sessions.items()):
+                    remaining = [session_id for session_id in ids if session_id not in session_ids]
+                    if len(remaining) != len(ids):
+                        self._dirty = True
+                        if remaining:
+                            project_sessions[name] = remaining
+                        else:
+                            del project_sessions[name]
+                if not project_sessions:
+                    del self.projects[project_name]
+
+    def refresh(self, sessions):
+        """
+        Replace the whole index with sessions of a complete listing.
+        """
+        projects = {}
+        for session_info in sessions:
+            labels = session_labels(session_info)
+            if labels.get('project_name') and labels.get('name') is not None:
+                projects.setdefault(labels['project_name'], {}).setdefault(labels['name'], []) \
+                    .append(session_identifier(session_info))
+        with self._lock:
+            if projects != self.projects:
+                self._projects = projects
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if self._dirty:
+                self.database.write(self.section, self._projects)
+                self._dirty = False
@@ -9,3 +9,10 @@ def cleanup_environment_variables(request):
     for k, v in os.environ.items():
         if k.startswith('MUTAGEN_HELPER'):
             del os.environ[k]
+
+
+@pytest.fixture(autouse=True)
+def mutagen_helper_home(tmp_path_factory, monkeypatch):
+    home = tmp_path_factory.mktemp('mutagen-helper-home')
+    monkeypatch.setenv('MUTAGEN_HELPER_HOME', str(home))
+    return home
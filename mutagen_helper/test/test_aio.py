@@ -0,0 +1,180 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pkg_resources
+import pytest
+
+from mutagen_helper.aio import AsyncManager, AsyncMutagenWrapper, AsyncProcessWrapper, AsyncTaskExecutor
+from mutagen_helper.executor import Task, TaskExecutionException
+from mutagen_helper.wrapper import ProcessTimeoutException
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def cwd_path(tmp_path, request):
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+
+    def restore_cwd():
+        os.chdir(cwd)
+
+    request.addfinalizer(restore_cwd)
+    return tmp_path
+
+
+def test_process_wrapper_run(loop):
+    result = loop.run_until_complete(AsyncProcessWrapper().run(
+        [sys.executable, '-c', 'import sys; sys.stdout.write("o" * 200000); sys.stderr.write("error"); sys.exit(3)']))
+    assert result.returncode == 3
+    assert result.stdout == "o" * 200000
+    assert result.stderr == "error"
+
+
+def test_process_wrapper_timeout(loop):
+    with pytest.raises(ProcessTimeoutException) as e:
+        loop.run_until_complete(AsyncProcessWrapper(timeout=0.5).run(
+            [sys.executable, '-c', 'import sys, time; sys.stdout.write("partial"); sys.stdout.flush(); time.sleep(5)']))
+    assert e.value.result.stdout == "partial"
+
+
+def test_task_executor_errors(loop):
+    async def _task(name):
+        await asyncio.sleep(0.01)
+        if name != 'b':
+            raise ValueError('%s failed' % name)
+        return name
+
+    tasks = [Task(_task, name, name=name, group='host') for name in ['a', 'b', 'c']]
+    with pytest.raises(TaskExecutionException) as e:
+        loop.run_until_complete(AsyncTaskExecutor(group_jobs={'host': 1}).run(tasks))
+    assert [task.name for task, _ in e.value.errors] == ['a', 'c']
+
+
+def test_manager_down_with_sessions_missing_from_index(loop, cwd_path):
+    path1 = os.path.join(cwd_path, 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'w') as f:
+        f.write("beta: /tmp/mutagen-helper-beta\nsessions:\n  - name: a\n  - name: b\n")
+
+    manager = AsyncManager()
+    loop.run_until_complete(manager.wrapper.terminate())
+    assert len(loop.run_until_complete(manager.up(cwd_path, session='a'))) == 1
+    # Sessions created without cache are missing from the session index.
+    assert len(loop.run_until_complete(AsyncManager(cache=False).up(cwd_path, session='b'))) == 1
+
+    assert len(loop.run_until_complete(AsyncManager().down(project='test1'))) == 2
+    assert loop.run_until_complete(manager.wrapper.list()) == []
+
+
+def test_mutagen_wrapper_create_and_control(loop, cwd_path):
+    wrapper = AsyncMutagenWrapper()
+    loop.run_until_complete(wrapper.terminate())
+
+    session_ids = [loop.run_until_complete(wrapper.create(os.path.join(cwd_path, 'alpha%i' % i),
+                                                          os.path.join(cwd_path, 'beta%i' % i),
+                                                          {'label': ['test=%i' % i]}))
+                   for i in range(2)]
+    try:
+        assert all(session_ids)
+        assert sorted(loop.run_until_complete(wrapper.flush())) == sorted(session_ids)
+        assert loop.run_until_complete(wrapper.pause(session_id=session_ids[0])) == [session_ids[0]]
+        assert loop.run_until_complete(wrapper.resume(label_selector='test==0', one=True)) == session_ids[0]
+
+        lst = loop.run_until_complete(wrapper.list())
+        assert wrapper.commands.json_list is True
+        assert sorted(item['Identifier'] for item in lst) == sorted(session_ids)
+        assert loop.run_until_complete(wrapper.list(label_selector='test==1', one=True))['Identifier'] == \
+            session_ids[1]
+    finally:
+        assert sorted(loop.run_until_complete(wrapper.terminate())) == sorted(session_ids)
+    assert loop.run_until_complete(wrapper.list()) == []
+
+
+def test_mutagen_wrapper_text_list_fallback(loop, cwd_path):
+    # Mutagen without structured listing, rejecting the --template flag.
+    mutagen = os.path.join(cwd_path, 'mutagen')
+    with open(mutagen, 'w') as f:
+        f.write('#!%s\n'
+                'import os, sys\n'
+                'if "--template" in sys.argv:\n'
+                '    sys.stderr.write("Error: unknown flag: --template\\n")\n'
+                '    sys.exit(1)\n'
+                'os.execvp("mutagen", ["mutagen"] + sys.argv[1:])\n' % sys.executable)
+    os.chmod(mutagen, 0o755)
+
+    wrapper = AsyncMutagenWrapper(mutagen)
+    loop.run_until_complete(wrapper.terminate())
+    session_id = loop.run_until_complete(wrapper.create(os.path.join(cwd_path, 'alpha'),
+                                                        os.path.join(cwd_path, 'beta')))
+    try:
+        lst = loop.run_until_complete(wrapper.list())
+        assert wrapper.commands.json_list is False
+        assert [item['Identifier'] for item in lst] == [session_id]
+        assert loop.run_until_complete(wrapper.list(session_id=session_id, one=True))['Identifier'] == session_id
+    finally:
+        loop.run_until_complete(wrapper.terminate())
+
+
+def test_mutagen_wrapper_timeouts(loop, monkeypatch):
+    monkeypatch.setenv('MUTAGEN_HELPER_LIST_TIMEOUT', '7')
+    monkeypatch.setenv('MUTAGEN_HELPER_CREATE_TIMEOUT', '0')
+    timeouts = []
+
+    async def _run(command, timeout=None):
+        timeouts.append(timeout)
+        return subprocess.CompletedProcess(command, 0, '', '')
+
+    wrapper = AsyncMutagenWrapper()
+    monkeypatch.setattr(wrapper.process_wrapper, 'run', _run)
+    for command in (['sync', 'list'], ['sync', 'create'], ['sync', 'flush'], ['version']):
+        loop.run_until_complete(wrapper.run(command))
+    loop.run_until_complete(wrapper.run(['sync', 'list'], timeout=3))
+    assert timeouts == [7, None, 1800, None, 3]
+
+    # The default timeout of the process wrapper applies to all commands.
+    wrapper = AsyncMutagenWrapper(timeout=5)
+    monkeypatch.setattr(wrapper.process_wrapper, 'run', _run)
+    loop.run_until_complete(wrapper.run(['sync', 'list']))
+    assert timeouts[-1] is None
+
+
+def test_manager_up_control_and_list(loop, cwd_path):
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+    os.mkdir(path1)
+    os.mkdir(path3)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(os.path.join(path3, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager = AsyncManager(jobs=2)
+    loop.run_until_complete(manager.wrapper.terminate())
+
+    session_ids = loop.run_until_complete(manager.up(cwd_path))
+    assert len(session_ids) == 2
+    assert loop.run_until_complete(manager.up(cwd_path)) == []
+
+    lst = loop.run_until_complete(manager.list(cwd_path))
+    assert sorted(item['Identifier'] for item in lst) == sorted(session_ids)
+    assert sorted(item['Mutagen Helper']['Project name'] for item in lst) == ['test1', 'test3']
+    assert len(loop.run_until_complete(manager.list(cwd_path, project='test3', session='0'))) == 1
+
+    assert sorted(loop.run_until_complete(manager.pause(cwd_path))) == sorted(session_ids)
+    assert all(item['Status'] == '[Paused]' for item in loop.run_until_complete(manager.list(cwd_path)))
+    assert sorted(loop.run_until_complete(manager.resume(cwd_path))) == sorted(session_ids)
+    assert sorted(loop.run_until_complete(manager.flush(cwd_path))) == sorted(session_ids)
+
+    assert len(loop.run_until_complete(manager.down(project='test1'))) == 1
+    assert len(loop.run_until_complete(manager.list(cwd_path))) == 1
+    assert loop.run_until_complete(manager.down(project='test3', session='blabla')) == []
+    assert len(loop.run_until_complete(manager.down(cwd_path))) == 1
+    assert loop.run_until_complete(manager.list(cwd_path)) == []
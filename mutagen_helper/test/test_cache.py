@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from mutagen_helper import scanner
+from mutagen_helper.cache import ConfigurationCache, DiscoveryIndex
+from mutagen_helper.parser import ProjectParser
+
+
+@pytest.fixture
+def parser():
+    return ProjectParser()
+
+
+@pytest.fixture
+def cache():
+    return ConfigurationCache()
+
+
+def _parse(parser: ProjectParser, cache: ConfigurationCache, configuration_filepath):
+    with parser.track() as tracker:
+        projects = list(parser.parse(configuration_filepath))
+    cache.put(configuration_filepath, projects, tracker)
+    cache.save()
+    return projects
+
+
+def _write(filepath, content):
+    with open(filepath, 'w') as f:
+        f.write(content)
+
+
+def test_cache_hit_and_invalidation(parser: ProjectParser, cache: ConfigurationCache, tmp_path, monkeypatch):
+    configuration_filepath = os.path.join(str(tmp_path), '.mutagen-helper.yml')
+    _write(configuration_filepath, "beta: '${TEST_BETA:-beta}'\n")
+
+    projects = _parse(parser, cache, configuration_filepath)
+    assert projects[0]['beta'] == 'beta'
+
+    assert ConfigurationCache().get(configuration_filepath) == projects
+
+    monkeypatch.setenv('TEST_BETA', 'other')
+    assert ConfigurationCache().get(configuration_filepath) is None
+    monkeypatch.delenv('TEST_BETA')
+    assert ConfigurationCache().get(configuration_filepath) == projects
+
+    _write(configuration_filepath, "beta: 'changed-beta'\n")
+    assert ConfigurationCache().get(configuration_filepath) is None
+
+
+def test_cache_auto_configure_invalidation(parser: ProjectParser, cache: ConfigurationCache, tmp_path):
+    configuration_filepath = os.path.join(str(tmp_path), '.mutagen-helper.yml')
+    _write(configuration_filepath, "auto_configure: True\nbeta: beta\n")
+    os.mkdir(os.path.join(str(tmp_path), 'test1'))
+
+    projects = _parse(parser, cache, configuration_filepath)
+    assert len(projects) == 1
+    assert ConfigurationCache().get(configuration_filepath) == projects
+
+    _write(os.path.join(str(tmp_path), 'test1', '.mutagen-helper.yml'), "beta: beta1\n")
+    assert ConfigurationCache().get(configuration_filepath) is None
+
+    projects = _parse(parser, cache, configuration_filepath)
+    assert projects[0]['beta'] == 'beta1'
+
+    os.mkdir(os.path.join(str(tmp_path), 'test2'))
+    assert ConfigurationCache().get(configuration_filepath) is None
+
+
+def test_cache_eviction(parser: ProjectParser, tmp_path):
+    cache = ConfigurationCache(max_entries=2)
+    configuration_filepaths = []
+    for i in range(3):
+        os.mkdir(os.path.join(str(tmp_path), 'test%i' % i))
+        configuration_filepath = os.path.join(str(tmp_path), 'test%i' % i, '.mutagen-helper.yml')
+        _write(configuration_filepath, "beta: beta\n")
+        _parse(parser, cache, configuration_filepath)
+        configuration_filepaths.append(configuration_filepath)
+
+    cache = ConfigurationCache()
+    assert cache.get(configuration_filepaths[0]) is None
+    assert cache.get(configuration_filepaths[1]) is not None
+    assert cache.get(configuration_filepaths[2]) is not None
+
+    cache.clear()
+    assert ConfigurationCache().get(configuration_filepaths[2]) is None
+
+
+def test_discovery_index(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    for directory in ['a', 'b/project']:
+        os.makedirs(os.path.join(root, directory))
+    _write(os.path.join(root, 'a', '.mutagen-helper.yml'), "beta: beta\n")
+    _write(os.path.join(root, 'b', 'project', '.mutagen-helper.yml'), "beta: beta\n")
+
+    read_directories = []
+    read_directory = scanner._read_directory
+
+    def _read_directory(path, prune):
+        read_directories.append(path)
+        return read_directory(path, prune)
+
+    monkeypatch.setattr(scanner, '_read_directory', _read_directory)
+
+    def _discover(index):
+        del read_directories[:]
+        files = sorted(scanner.configuration_files(root, depth=2, index=index))
+        index.save()
+        return files
+
+    expected = [os.path.join(root, 'a', '.mutagen-helper.yml'),
+                os.path.join(root, 'b', 'project', '.mutagen-helper.yml')]
+    assert _discover(DiscoveryIndex()) == expected
+    assert len(read_directories) == 4
+
+    assert _discover(DiscoveryIndex()) == expected
+    assert read_directories == []
+
+    os.makedirs(os.path.join(root, 'c'))
+    _write(os.path.join(root, 'c', 'mutagen-helper.yml'), "beta: beta\n")
+    assert _discover(DiscoveryIndex()) == expected + [os.path.join(root, 'c', 'mutagen-helper.yml')]
+    assert sorted(read_directories) == [root, os.path.join(root, 'c')]
+
+    os.unlink(os.path.join(root, 'a', '.mutagen-helper.yml'))
+    assert _discover(DiscoveryIndex())[0] == os.path.join(root, 'b', 'project', '.mutagen-helper.yml')
+    assert read_directories == [os.path.join(root, 'a')]
+
+    assert len(_discover(DiscoveryIndex(rescan=True))) == 2
+    assert len(read_directories) == 5
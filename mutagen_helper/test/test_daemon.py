@@ -0,0 +1,74 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+from click import ClickException
+
+from mutagen_helper.daemon import Daemon, connect
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="unix domain sockets are required")
+
+
+@pytest.fixture
+def daemon_path(tmp_path):
+    path = os.path.join(str(tmp_path), 'daemon.sock')
+    daemon = Daemon(path)
+    thread = threading.Thread(target=daemon.serve)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    daemon.shutdown()
+    thread.join(5)
+
+
+def test_connect_without_daemon(tmp_path):
+    assert connect(os.path.join(str(tmp_path), 'daemon.sock')) is None
+
+
+def test_clear_cache(daemon_path):
+    client = connect(daemon_path)
+    assert client is not None
+    assert client.clear_cache() is None
+
+
+def test_unknown_command(daemon_path):
+    client = connect(daemon_path)
+    with pytest.raises(ClickException):
+        client._result('unknown')
+
+
+def test_list(daemon_path, tmp_path):
+    client = connect(daemon_path)
+    assert client.list(str(tmp_path)) == []
+
+
+def test_list_fields(daemon_path, tmp_path):
+    path1 = os.path.join(str(tmp_path), 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'w') as f:
+        f.write("beta: '/tmp/mutagen-helper-beta'\n")
+
+    assert len(connect(daemon_path).up(str(tmp_path))) == 1
+    try:
+        items = connect(daemon_path).list(str(tmp_path), fields=['Identifier'])
+        assert len(items) == 1
+        assert list(items[0]) == ['Identifier']
+    finally:
+        connect(daemon_path).down(str(tmp_path))
+
+
+def test_connect_with_other_settings(daemon_path, monkeypatch):
+    monkeypatch.setenv('MUTAGEN_HELPER_DEPTH', '3')
+    assert connect(daemon_path) is not None
+
+    monkeypatch.setenv('MUTAGEN_HELPER_JSON_LIST', '0')
+    assert connect(daemon_path) is None
+    monkeypatch.delenv('MUTAGEN_HELPER_JSON_LIST')
+
+    monkeypatch.setattr('mutagen_helper.daemon.__version__', '0.0.0')
+    assert connect(daemon_path) is None
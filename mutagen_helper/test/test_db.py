@@ -0,0 +1,30 @@
+import os
+
+from mutagen_helper.db import Database
+
+
+def test_sections(tmp_path):
+    directory = os.path.join(str(tmp_path), 'db')
+    database = Database(directory)
+    assert database.read('first') == {}
+
+    database.write('first', {'a': 1})
+    database.write('second', {'b': [2]})
+    assert sorted(os.listdir(directory)) == ['first.json', 'second.json']
+    assert database.read('first') == {'a': 1}
+    assert Database(directory).read('second') == {'b': [2]}
+
+    database.write('first', None)
+    assert sorted(os.listdir(directory)) == ['second.json']
+    assert database.read('first') == {}
+
+
+def test_invalid_section(tmp_path):
+    database = Database(str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'invalid.json'), 'w') as f:
+        f.write('{')
+    assert database.read('invalid') == {}
+
+    with open(os.path.join(str(tmp_path), 'list.json'), 'w') as f:
+        f.write('[]')
+    assert database.read('list') == {}
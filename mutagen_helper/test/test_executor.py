@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from mutagen_helper.executor import Task, TaskExecutor, TaskExecutionException
+
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def log_handler():
+    root = logging.getLogger()
+    handler = _RecordingHandler()
+    level = root.level
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    yield handler
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def _task(name, delay):
+    logging.info('%s started' % name)
+    time.sleep(delay)
+    logging.info('%s done' % name)
+    return name
+
+
+def _failing_task(name):
+    raise ValueError('%s failed' % name)
+
+
+def test_results_keep_order():
+    tasks = [Task(_task, str(i), 0.05 * (3 - i)) for i in range(3)]
+    assert TaskExecutor(jobs=3).run(tasks) == ['0', '1', '2']
+
+
+def test_logs_are_grouped_by_task(log_handler):
+    tasks = [Task(_task, str(i), 0.05 * (3 - i)) for i in range(3)]
+    TaskExecutor(jobs=3).run(tasks)
+
+    messages = log_handler.messages
+    assert len(messages) == 6
+    for i in range(0, 6, 2):
+        assert messages[i].replace('started', 'done') == messages[i + 1]
+
+
+def test_errors_are_aggregated():
+    tasks = [Task(_failing_task, 'a', name='a'), Task(_task, 'b', 0, name='b'), Task(_failing_task, 'c', name='c')]
+    with pytest.raises(TaskExecutionException) as e:
+        TaskExecutor(jobs=2).run(tasks)
+    assert [task.name for task, _ in e.value.errors] == ['a', 'c']
+
+
+def test_single_error_is_raised_as_is():
+    tasks = [Task(_failing_task, 'a', name='a'), Task(_task, 'b', 0, name='b')]
+    with pytest.raises(ValueError):
+        TaskExecutor(jobs=2).run(tasks)
+
+
+class _RecordingPool:
+    """
+    Records when the scheduler submits tasks, which worker threads may start later.
+    """
+
+    def __init__(self, pool, submits):
+        self.pool = pool
+        self.submits = submits
+
+    def submit(self, fn, task):
+        self.submits.setdefault(task.group, []).append(time.monotonic())
+        return self.pool.submit(fn, task)
+
+
+class _RecordingExecutor(TaskExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submits = {}
+
+    def _schedule(self, pool, tasks):
+        return super()._schedule(_RecordingPool(pool, self.submits), tasks)
+
+
+def test_group_jobs_and_delays():
+    lock = threading.Lock()
+    running = {'a': 0, 'b': 0}
+    peaks = {'a': 0, 'b': 0}
+
+    def _group_task(group):
+        with lock:
+            running[group] += 1
+            peaks[group] = max(peaks[group], running[group])
+        time.sleep(0.05)
+        with lock:
+            running[group] -= 1
+
+    tasks = [Task(_group_task, group, group=group) for group in ['a'] * 4 + ['b'] * 4]
+    executor = _RecordingExecutor(jobs=8, group_jobs={'a': 1, 'b': 3}, group_delays={'b': 0.02})
+    executor.run(tasks)
+
+    assert peaks == {'a': 1, 'b': 3}
+    submits = executor.submits['b']
+    assert len(submits) == 4
+    assert all(later - earlier >= 0.019 for earlier, later in zip(submits, submits[1:]))
+
+
+def test_group_delays_without_running_tasks(monkeypatch):
+    import mutagen_helper.executor as executor_module
+
+    waits = []
+    wait = executor_module.wait
+
+    def _counting_wait(*args, **kwargs):
+        waits.append(args)
+        return wait(*args, **kwargs)
+
+    monkeypatch.setattr(executor_module, 'wait', _counting_wait)
+    tasks = [Task(lambda: None, group='b') for _ in range(3)]
+    started = time.monotonic()
+    TaskExecutor(jobs=2, group_delays={'b': 0.1}).run(tasks)
+
+    assert time.monotonic() - started >= 0.19
+    # Waiting for the group delay sleeps instead of spinning on wait().
+    assert len(waits) < 20
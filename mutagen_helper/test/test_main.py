@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+
+import pkg_resources
+import pytest
+from click.testing import CliRunner
+
+from mutagen_helper.__main__ import _print_json_list, main
+
+# Cumulated import time allowed to the entry point, in milliseconds.
+import_time_budget = int(os.environ.get('MUTAGEN_HELPER_IMPORT_TIME_BUDGET', 300))
+
+
+def _run_python(*args):
+    return subprocess.run([sys.executable] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def test_entry_point_imports_no_heavy_module():
+    result = _run_python('-c', 'import sys; import mutagen_helper.__main__; print("\\n".join(sys.modules))')
+    modules = result.stdout.splitlines()
+    for module in ['yaml', 'expandvars', 'subprocess', 'mutagen_helper.manager', 'mutagen_helper.wrapper']:
+        assert module not in modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires python 3.7+")
+def test_entry_point_import_time():
+    result = _run_python('-X', 'importtime', '-c', 'import mutagen_helper.__main__')
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'mutagen_helper.__main__':
+            assert int(fields[1]) / 1000 < import_time_budget
+            break
+    else:
+        pytest.fail('mutagen_helper.__main__ import time not found')
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    from mutagen_helper.manager import Manager
+
+    path1 = os.path.join(str(tmp_path), 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+
+    manager = Manager()
+    manager._internals.wrapper.terminate()
+    manager.up(str(tmp_path))
+    yield str(tmp_path)
+    manager.down(str(tmp_path))
+
+
+def _list(*args):
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(main, ['--silent', '--no-daemon', 'list'] + list(args), catch_exceptions=False)
+    assert result.exit_code == 0
+    return result.stdout
+
+
+@pytest.mark.parametrize('items', [[], [{'a': 1}], [{'a': [1, {'b': None}], 'c': 'd'}, {'e': {}}]])
+def test_print_json_list(items, capsys):
+    _print_json_list(iter(items))
+    assert capsys.readouterr().out == json.dumps(items, indent=2) + '\n'
+
+
+def test_list_json(workspace):
+    output = _list('-p', workspace)
+    items = json.loads(output)
+    assert output == json.dumps(items, indent=2) + '\n'
+    assert len(items) == 1
+    assert items[0]['Mutagen Helper']['Project name'] == 'test1'
+    assert 'Identifier' in items[0]
+
+
+def test_list_ndjson(workspace):
+    lines = _list('-p', workspace, '--format', 'ndjson').splitlines()
+    assert len(lines) == 1
+    item = json.loads(lines[0])
+    assert lines[0] == json.dumps(item, separators=(',', ':'))
+    assert item['Mutagen Helper']['Project name'] == 'test1'
+
+
+def test_list_fields(workspace):
+    items = json.loads(_list('-p', workspace, '--fields', 'Identifier, Mutagen Helper,Unknown'))
+    assert len(items) == 1
+    assert set(items[0]) == {'Identifier', 'Mutagen Helper'}
+
+    lines = _list('-p', workspace, '-f', 'ndjson', '--fields', 'Unknown').splitlines()
+    assert [json.loads(line) for line in lines] == [{}]
@@ -1,9 +1,12 @@
 import os
+import shutil
+import time
 
 import pkg_resources
 import pytest
+from click import ClickException
 
-from mutagen_helper.manager import Manager
+from mutagen_helper.manager import Manager, _creation_timestamp, sanitize_path
 
 
 @pytest.fixture
@@ -179,6 +182,31 @@ def test_up_twice_and_down_twice(manager: Manager, cwd_path: str):
     assert len(lst) == 0
 
 
+def test_down_with_sessions_missing_from_index(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'w') as f:
+        f.write("beta: /tmp/mutagen-helper-beta\nsessions:\n  - name: a\n  - name: b\n")
+
+    manager._internals.wrapper.terminate()
+    assert len(manager.up(cwd_path, session='a')) == 1
+    # Sessions created without cache are missing from the session index.
+    assert len(Manager(cache=False).up(cwd_path, session='b')) == 1
+    assert len(Manager(cache=False).list(cwd_path)) == 2
+
+    handled_sessions = Manager().down(project='test1')
+    assert len(handled_sessions) == 2
+    assert manager.list(cwd_path) == []
+
+    assert len(manager.up(cwd_path, session='a')) == 1
+    Manager(cache=False).down(cwd_path, session='a')
+    assert len(Manager(cache=False).up(cwd_path, session='a')) == 1
+    # The indexed identifier of the session is stale.
+    handled_sessions = Manager().down(project='test1', session='a')
+    assert len(handled_sessions) == 1
+    assert manager.list(cwd_path) == []
+
+
 def test_up_and_down_with_resume_pause_flush(manager: Manager, cwd_path: str):
     path1 = os.path.join(cwd_path, 'test1')
     path2 = os.path.join(cwd_path, 'test2')
@@ -213,6 +241,35 @@ def test_up_and_down_with_resume_pause_flush(manager: Manager, cwd_path: str):
     assert len(lst) == 0
 
 
+def test_up_and_down_with_small_control_batches(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+
+    os.mkdir(path1)
+    os.mkdir(path3)
+
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+
+    with open(os.path.join(path3, 'mutagen-helper.yaml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager._internals.wrapper.terminate()
+    manager._internals.control_batch_size = 1
+
+    handled_sessions = manager.up(cwd_path)
+    assert len(handled_sessions) == 2
+
+    paused_sessions = manager.pause(cwd_path)
+    assert sorted(paused_sessions) == sorted(handled_sessions)
+
+    terminated_sessions = manager.down(cwd_path)
+    assert sorted(terminated_sessions) == sorted(paused_sessions)
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 0
+
+
 def test_auto_configure(manager: Manager, cwd_path: str):
     path1 = os.path.join(cwd_path, 'test1')
     path2 = os.path.join(cwd_path, 'test2')
@@ -377,3 +434,313 @@ def test_auto_configure_advanced(manager: Manager, cwd_path: str):
 
     lst = manager.list(cwd_path)
     assert len(lst) == 0
+
+
+def test_watch_reconcile(manager: Manager, cwd_path: str):
+    internals = manager._internals
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+    os.mkdir(path1)
+    os.mkdir(path3)
+
+    mutagen1 = os.path.join(path1, '.mutagen-helper.yml')
+    mutagen3 = os.path.join(path3, '.mutagen-helper.yml')
+    with open(mutagen1, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+
+    internals.wrapper.terminate()
+
+    internals.up(str(cwd_path))
+    project_files = dict(internals._load_project_files(str(cwd_path)))
+    definitions = internals._session_definitions(project_files)
+    test1_id = manager.list(cwd_path)[0]['Identifier']
+
+    # Added project file
+    with open(mutagen3, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+    project_files = internals._reload_project_files(str(cwd_path), project_files, {mutagen3})
+    new_definitions = internals._session_definitions(project_files)
+    assert set(new_definitions) == {('test1', '0'), ('test3', '0')}
+    internals._reconcile(definitions, new_definitions)
+    definitions = new_definitions
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 2
+    assert test1_id in [item['Identifier'] for item in lst]
+
+    # Changed project file
+    with open(mutagen3, 'w') as f:
+        f.write('beta: beta3-changed\nappend_project_name_to_beta: false\n')
+    project_files = internals._reload_project_files(str(cwd_path), project_files, {mutagen3})
+    new_definitions = internals._session_definitions(project_files)
+    internals._reconcile(definitions, new_definitions)
+    definitions = new_definitions
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 2
+    assert test1_id in [item['Identifier'] for item in lst]
+    assert any(item['Beta']['URL'].endswith('beta3-changed') for item in lst)
+
+    # Removed project file
+    os.unlink(mutagen1)
+    project_files = internals._reload_project_files(str(cwd_path), project_files, {mutagen1})
+    new_definitions = internals._session_definitions(project_files)
+    internals._reconcile(definitions, new_definitions)
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 1
+    assert lst[0]['Mutagen Helper']['Project name'] == 'test3'
+
+    internals.wrapper.terminate()
+
+
+def test_up_recreates_changed_sessions(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+    os.mkdir(path1)
+    os.mkdir(path3)
+
+    mutagen1 = os.path.join(path1, '.mutagen-helper.yml')
+    mutagen3 = os.path.join(path3, '.mutagen-helper.yml')
+    with open(mutagen1, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(mutagen3, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager._internals.wrapper.terminate()
+
+    handled_sessions = manager.up(cwd_path)
+    assert len(handled_sessions) == 2
+    assert all(item['Labels'].get('config_hash') for item in manager.list(cwd_path))
+
+    handled_sessions = manager.up(cwd_path)
+    assert len(handled_sessions) == 0
+
+    with open(mutagen3, 'w') as f:
+        f.write('beta: beta3-changed\nappend_project_name_to_beta: false\n')
+
+    handled_sessions = manager.up(cwd_path)
+    assert len(handled_sessions) == 1
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 2
+    assert [item['Identifier'] for item in lst if item['Mutagen Helper']['Project name'] == 'test3'] == \
+        handled_sessions
+    assert any(item['Beta']['URL'].endswith('beta3-changed') for item in lst)
+
+    manager.down(cwd_path)
+
+
+def test_plan_and_apply(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+    os.mkdir(path1)
+    os.mkdir(path3)
+
+    mutagen1 = os.path.join(path1, '.mutagen-helper.yml')
+    mutagen3 = os.path.join(path3, '.mutagen-helper.yml')
+    with open(mutagen1, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(mutagen3, 'w') as f:
+        f.write('beta: beta3\nappend_project_name_to_beta: false\nsessions:\n  - name: a\n  - name: b\n')
+
+    manager._internals.wrapper.terminate()
+
+    plan = manager.plan(cwd_path)
+    assert plan['summary'] == {'create': 3, 'keep': 0, 'recreate': 0, 'terminate': 0}
+    assert plan['invocations'] == 3
+    assert len(manager.apply(plan)) == 3
+    # Sessions of the plan already exist.
+    assert manager.apply(plan) == []
+    assert len(manager.list(cwd_path)) == 3
+
+    with open(mutagen3, 'w') as f:
+        f.write('beta: beta3-changed\nappend_project_name_to_beta: false\nsessions:\n  - name: a\n')
+
+    plan = manager.plan(cwd_path)
+    assert plan['summary'] == {'create': 0, 'keep': 1, 'recreate': 1, 'terminate': 1}
+    # A single terminate command, and a create command.
+    assert plan['invocations'] == 2
+    assert manager.plan(cwd_path)['summary'] == plan['summary']
+
+    assert len(manager.apply(plan)) == 1
+    assert manager.apply(plan) == []
+    assert manager.plan(cwd_path)['summary'] == {'create': 0, 'keep': 2, 'recreate': 0, 'terminate': 0}
+
+    lst = manager.list(cwd_path)
+    assert len(lst) == 2
+    assert any(item['Beta']['URL'].endswith('beta3-changed') for item in lst)
+
+    manager.down(cwd_path)
+
+
+def test_up_with_single_label(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'w') as f:
+        f.write("beta: /tmp/mutagen-helper-beta\noptions:\n  label: 'foo=bar'\n")
+
+    internals = manager._internals
+    session = internals._load_project_files(str(cwd_path))[0][1][0]['sessions'][0]
+    _, _, options = internals._create_arguments('test1', session)
+    assert options['label'][:3] == ['foo=bar', 'project_name=test1', 'name=0']
+    assert session['options']['label'] == 'foo=bar'
+
+    internals.wrapper.terminate()
+    assert len(manager.up(cwd_path)) == 1
+    labels = manager.list(cwd_path)[0]['Labels']
+    assert labels['foo'] == 'bar'
+    assert labels['project_name'] == 'test1'
+    manager.down(cwd_path)
+
+
+def test_gc(manager: Manager, cwd_path: str):
+    path1 = os.path.join(cwd_path, 'test1')
+    path3 = os.path.join(cwd_path, 'test3')
+    os.mkdir(path1)
+    os.mkdir(path3)
+
+    mutagen1 = os.path.join(path1, '.mutagen-helper.yml')
+    mutagen3 = os.path.join(path3, '.mutagen-helper.yml')
+    with open(mutagen1, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(mutagen3, 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager._internals.wrapper.terminate()
+    assert len(manager.up(cwd_path)) == 2
+    assert manager.gc(cwd_path) == []
+
+    os.unlink(mutagen1)
+    orphans = manager.gc(cwd_path, dry_run=True)
+    assert len(orphans) == 1
+    assert manager.gc(cwd_path, min_age=3600) == []
+    assert manager.gc(cwd_path) == orphans
+    assert manager.gc(cwd_path) == []
+
+    lst = manager._internals.wrapper.list()
+    assert [item['Labels']['project_name'] for item in lst] == ['test3']
+
+    manager.down(cwd_path)
+
+
+def test_gc_undiscovered(manager: Manager, cwd_path: str):
+    workspace = os.path.join(cwd_path, 'workspace')
+    path1 = os.path.join(workspace, 'test1')
+    path3 = os.path.join(workspace, 'test3')
+    os.makedirs(path1)
+    os.makedirs(path3)
+
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(os.path.join(path3, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager._internals.wrapper.terminate()
+    assert len(manager.up(workspace)) == 2
+
+    # Configuration files are deeper than discovery depth from the parent directory.
+    assert manager.gc(cwd_path, dry_run=True) == []
+    assert len(manager.gc(cwd_path, dry_run=True, force=True)) == 2
+
+    shutil.rmtree(path1)
+    assert len(manager.gc(cwd_path)) == 1
+    assert [item['Labels']['project_name'] for item in manager._internals.wrapper.list()] == ['test3']
+
+    manager.down(workspace)
+
+
+def test_gc_min_age_without_creation_time(cwd_path: str, monkeypatch):
+    monkeypatch.setenv('MUTAGEN_HELPER_JSON_LIST', '0')
+    manager = Manager()
+    with pytest.raises(ClickException):
+        manager.gc(cwd_path, min_age=3600)
+
+
+def test_creation_timestamp():
+    assert _creation_timestamp('2020-06-18T09:12:41.5Z') == 1592471561.5
+    assert _creation_timestamp('2020-06-18T11:12:41+02:00') == 1592471561
+    assert _creation_timestamp('yesterday') is None
+
+
+def test_many_paths(manager: Manager, cwd_path: str, monkeypatch):
+    root1 = os.path.join(cwd_path, 'root1')
+    root2 = os.path.join(cwd_path, 'root2')
+    path1 = os.path.join(root1, 'test1')
+    path3 = os.path.join(root2, 'test3')
+    os.makedirs(path1)
+    os.makedirs(path3)
+
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+    with open(os.path.join(path3, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test3.yml"))
+
+    manager._internals.wrapper.terminate()
+
+    assert len(manager.project_files([root1, root2, root1])) == 2
+    assert len(manager.up([root1, root2])) == 2
+    assert len(manager.list(root1)) == 1
+
+    monkeypatch.setenv('MUTAGEN_HELPER_PATH', os.pathsep.join([root1, root2]))
+    assert len(manager.list()) == 2
+    assert len(manager.down()) == 2
+
+
+def test_sanitize_path(cwd_path: str, monkeypatch):
+    assert sanitize_path() == os.getcwd()
+    assert sanitize_path('a') == 'a'
+    assert sanitize_path(('a',)) == 'a'
+    assert sanitize_path(('a', 'b')) == ['a', 'b']
+
+    monkeypatch.setenv('MUTAGEN_HELPER_PATH', 'c')
+    assert sanitize_path() == 'c'
+    assert sanitize_path(()) == 'c'
+    monkeypatch.setenv('MUTAGEN_HELPER_PATH', os.pathsep.join(['c', 'd', '']))
+    assert sanitize_path() == ['c', 'd']
+
+
+def test_compile(manager: Manager, cwd_path: str, monkeypatch):
+    internals = manager._internals
+    path1 = os.path.join(cwd_path, 'test1')
+    os.mkdir(path1)
+    mutagen1 = os.path.join(path1, '.mutagen-helper.yml')
+    with open(mutagen1, 'w') as f:
+        f.write("beta: '${TEST_BETA:-beta1}'\n")
+
+    compiled_file = internals._compiled_file(str(cwd_path))
+    assert manager.compile(cwd_path) == [compiled_file]
+    assert not compiled_file.startswith(str(cwd_path))
+    assert os.listdir(str(cwd_path)) == ['test1']
+    project_files = internals._load_compiled(str(cwd_path))
+    assert [project_file for project_file, _ in project_files] == [mutagen1]
+    assert project_files[0][1][0]['beta'] == 'beta1'
+    assert internals._load_project_files(str(cwd_path)) == project_files
+
+    monkeypatch.setenv('TEST_BETA', 'beta2')
+    assert internals._load_compiled(str(cwd_path)) is None
+    manager.compile(cwd_path)
+    assert internals._load_compiled(str(cwd_path))[0][1][0]['beta'] == 'beta2'
+
+    # Directory mtime must move past the one recorded by compile.
+    time.sleep(0.05)
+    os.mkdir(os.path.join(cwd_path, 'test2'))
+    assert internals._load_compiled(str(cwd_path)) is None
+
+
+def test_create_arguments_cache(manager: Manager, cwd_path: str):
+    internals = manager._internals
+    path1 = os.path.join(cwd_path, 'test1')
+    os.mkdir(path1)
+    with open(os.path.join(path1, '.mutagen-helper.yml'), 'wb') as f:
+        f.write(pkg_resources.resource_string(__name__, "data/test1.yml"))
+
+    project = internals._load_project_files(str(cwd_path))[0][1][0]
+    session = project['sessions'][0]
+    arguments = internals._create_arguments('test1', session)
+    assert internals._create_arguments('test1', session) is arguments
+    assert internals._create_arguments('other', session) is not arguments
+    assert len(internals._arguments) == 1
+
+    del project, session
+    assert internals._arguments == {}
@@ -0,0 +1,59 @@
+import pkg_resources
+import pytest
+
+from mutagen_helper.model import Project
+from mutagen_helper.parser import ProjectParser
+
+
+@pytest.fixture
+def projects():
+    return list(ProjectParser().load(pkg_resources.resource_filename(__name__, "data/test_parser_projects.yml")))
+
+
+def test_inherited_values_are_shared(projects):
+    assert len(projects) == 3
+    assert projects[0]['options'] is projects[1]['options']
+    assert projects[0]['sessions'][0]['options'] is projects[0]['options']
+    assert projects[2]['sessions'][0]['options']['default-file-mode-beta'] == 600
+
+
+def test_immutable(projects):
+    session = projects[0]['sessions'][0]
+    with pytest.raises(TypeError):
+        session['beta'] = 'other'
+    with pytest.raises(AttributeError):
+        session._values = {}
+    with pytest.raises(AttributeError):
+        session.other = None
+
+
+def test_to_dict(projects):
+    expected = list(ProjectParser().parse(pkg_resources.resource_filename(__name__, "data/test_parser_projects.yml")))
+    data = [project.to_dict() for project in projects]
+    assert data == expected
+    assert data[0]['options'] is not data[0]['sessions'][0]['options']
+
+    loaded = [Project.from_dict(project) for project in data]
+    assert loaded == projects
+    assert loaded[0]['sessions'][0]['options'] is loaded[0]['options']
+
+
+def test_project_dict_inheritance():
+    parser = ProjectParser()
+    data = {'beta': 'beta', 'options': {'sync-mode': 'two-way-resolved'}, 'auto_configure': True,
+            'projects': [{'path': 'test1'}, {'path': 'test2', 'beta': 'beta2', 'sessions': [{'name': 'a'}, {}]}]}
+    parser.handle_data_inheritance(data)
+    assert data['projects'][0]['beta'] == 'beta'
+    assert data['projects'][1]['beta'] == 'beta2'
+    assert 'auto_configure' not in data['projects'][0]
+
+    project = data['projects'][1]
+    parser.handle_project_inheritance(project)
+    parser.add_project_sessions_default_values(project)
+    assert project['sessions'] == [
+        {'name': 'a', 'path': 'test2', 'beta': 'beta2', 'options': {'sync-mode': 'two-way-resolved'}},
+        {'name': '1', 'path': 'test2', 'beta': 'beta2', 'options': {'sync-mode': 'two-way-resolved'}}]
+
+    project = data['projects'][0]
+    parser.handle_project_inheritance(project)
+    assert project['sessions'] == [{'path': 'test1', 'beta': 'beta', 'options': {'sync-mode': 'two-way-resolved'}}]
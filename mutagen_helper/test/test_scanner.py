@@ -87,3 +87,38 @@ def test_auto_excludes(cwd_path: str):
 def test_auto_no_project(cwd_path: str):
     with pytest.raises(AutoConfigureNoProject):
         list(scanner.auto_configure(cwd_path, {'enabled': True, 'exclude': ['*']}, parser=parser))
+
+
+def test_configuration_files_depth_and_prune(tmp_path):
+    root = str(tmp_path)
+    for directory in ['a', 'b/nested', 'b/nested/deeper', 'c/project/sub', 'node_modules/module']:
+        os.makedirs(os.path.join(root, directory))
+    configurations = [os.path.join(root, 'a', '.mutagen-helper.yml'),
+                      os.path.join(root, 'b', 'nested', 'mutagen-helper.yml'),
+                      os.path.join(root, 'b', 'nested', 'deeper', 'mutagen-helper.yml'),
+                      os.path.join(root, 'c', 'project', 'sub', 'mutagen-helper.yml'),
+                      os.path.join(root, 'node_modules', 'module', 'mutagen-helper.yml')]
+    for configuration in configurations:
+        with open(configuration, 'w'):
+            pass
+
+    assert list(scanner.configuration_files(root)) == [configurations[0]]
+    assert sorted(scanner.configuration_files(root, depth=2)) == sorted(configurations[0:2])
+    assert sorted(scanner.configuration_files(root, depth=3)) == sorted(configurations[0:2] + [configurations[3]])
+    assert sorted(scanner.configuration_files(root, depth=3, prune=['c'])) == \
+        sorted(configurations[0:2] + [configurations[4]])
+    assert list(scanner.configuration_files(root, depth=0)) == []
+
+
+def test_configuration_files_environment(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'a', 'project'))
+    configuration = os.path.join(root, 'a', 'project', '.mutagen-helper.yml')
+    with open(configuration, 'w'):
+        pass
+
+    assert list(scanner.configuration_files(root)) == []
+    monkeypatch.setenv('MUTAGEN_HELPER_DEPTH', '2')
+    assert list(scanner.configuration_files(root)) == [configuration]
+    monkeypatch.setenv('MUTAGEN_HELPER_PRUNE', 'a, b')
+    assert list(scanner.configuration_files(root)) == []
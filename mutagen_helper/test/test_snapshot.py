@@ -0,0 +1,85 @@
+import pytest
+
+from mutagen_helper.snapshot import SessionIndex, SessionSnapshot
+
+
+@pytest.fixture
+def snapshot():
+    return SessionSnapshot([
+        {'Identifier': 'sync_1', 'Labels': {'project_name': 'test1', 'name': '0'}},
+        {'Identifier': 'sync_2', 'Labels': {'project_name': 'test1', 'name': 'other'}},
+        {'Identifier': 'sync_3', 'Labels': {'project_name': 'test3', 'name': '0'},
+         'Beta': {'URL': '/tmp/beta3'}},
+        {'Identifier': 'sync_4', 'Labels': 'None'},
+    ])
+
+
+def test_find(snapshot: SessionSnapshot):
+    assert [s['Identifier'] for s in snapshot.find('test1')] == ['sync_1', 'sync_2']
+    assert [s['Identifier'] for s in snapshot.find('test1', '0')] == ['sync_1']
+    assert snapshot.find('test1', 'missing') == []
+    assert snapshot.find('test2') == []
+
+
+def test_add_and_discard(snapshot: SessionSnapshot):
+    snapshot.add({'Identifier': 'sync_5', 'Labels': {'project_name': 'test2', 'name': '0'}})
+    assert [s['Identifier'] for s in snapshot.find('test2', '0')] == ['sync_5']
+
+    snapshot.discard(['sync_1', 'sync_5'])
+    assert [s['Identifier'] for s in snapshot.find('test1')] == ['sync_2']
+    assert snapshot.find('test2') == []
+    assert len(snapshot.sessions) == 3
+
+
+def test_betas(snapshot: SessionSnapshot):
+    betas = snapshot.betas()
+    assert len(betas) == 1
+    assert list(betas.values())[0]['Identifier'] == 'sync_3'
+
+
+def test_lazy_snapshot():
+    calls = []
+
+    def loader():
+        calls.append(True)
+        return [{'Identifier': 'sync_1', 'Labels': {'project_name': 'test1', 'name': '0'}}]
+
+    snapshot = SessionSnapshot(loader=loader)
+    assert not snapshot.loaded
+    assert [s['Identifier'] for s in snapshot.find('test1')] == ['sync_1']
+    assert snapshot.find('test1', '0')
+    assert snapshot.loaded
+    assert len(calls) == 1
+
+
+def test_session_index(snapshot: SessionSnapshot):
+    index = SessionIndex()
+    index.refresh(snapshot.sessions)
+    index.add('test2', '0', 'sync_5')
+    index.save()
+
+    index = SessionIndex()
+    assert index.find('test1') == ['sync_1', 'sync_2']
+    assert index.find('test1', 'other') == ['sync_2']
+    assert index.find('test2', '0') == ['sync_5']
+    assert index.find('test4') == []
+
+    index.discard(['sync_1', 'sync_5'])
+    index.save()
+
+    index = SessionIndex()
+    assert index.find('test1') == ['sync_2']
+    assert index.find('test2') == []
+
+
+def test_session_index_unchanged_refresh(snapshot: SessionSnapshot, monkeypatch):
+    index = SessionIndex()
+    index.refresh(snapshot.sessions)
+    index.save()
+
+    index = SessionIndex()
+    writes = []
+    monkeypatch.setattr(index.database, 'write', lambda section, value: writes.append(section))
+    index.refresh(snapshot.sessions)
+    index.save()
+    assert writes == []
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+import pytest
+
+from mutagen_helper.watcher import InotifyWatcher, PollingWatcher
+
+
+def _inotify_watcher(path):
+    try:
+        return InotifyWatcher(path)
+    except OSError as e:
+        pytest.skip('inotify is not available: %s' % e)
+
+
+@pytest.fixture(params=['polling', 'inotify'])
+def create_watcher(request):
+    watchers = []
+
+    def create(path):
+        watcher = PollingWatcher(path, interval=0.1) if request.param == 'polling' else _inotify_watcher(path)
+        watchers.append(watcher)
+        return watcher
+
+    yield create
+    for watcher in watchers:
+        watcher.close()
+
+
+def test_configuration_file_changes(create_watcher, tmp_path):
+    project = os.path.join(str(tmp_path), 'project')
+    os.mkdir(project)
+    watcher = create_watcher(str(tmp_path))
+
+    configuration = os.path.join(project, '.mutagen-helper.yml')
+    with open(configuration, 'w') as f:
+        f.write('beta: beta1\n')
+    assert configuration in watcher.read(1)
+
+    with open(os.path.join(project, 'synced.txt'), 'w') as f:
+        f.write('not a configuration file')
+    assert watcher.read(0.3) == set()
+
+    os.unlink(configuration)
+    assert configuration in watcher.read(1)
+
+
+def test_child_directory_changes(create_watcher, tmp_path):
+    watcher = create_watcher(str(tmp_path))
+
+    project = os.path.join(str(tmp_path), 'project')
+    os.mkdir(project)
+    assert project in watcher.read(1)
+
+    configuration = os.path.join(project, 'mutagen-helper.yaml')
+    with open(configuration, 'w') as f:
+        f.write('beta: beta1\n')
+    assert configuration in watcher.read(1)
+
+
+def test_changes_are_debounced(create_watcher, tmp_path):
+    watcher = create_watcher(str(tmp_path))
+    configurations = [os.path.join(str(tmp_path), name) for name in ['a', 'b', 'c']]
+
+    def write_burst():
+        for configuration in configurations:
+            os.mkdir(configuration)
+            with open(os.path.join(configuration, '.mutagen-helper.yml'), 'w') as f:
+                f.write('beta: beta1\n')
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=write_burst)
+    thread.start()
+    changed = next(watcher.changes(debounce=0.5))
+    thread.join()
+    assert set(configurations) <= changed
+
+
+def test_nested_directory_changes(create_watcher, tmp_path, monkeypatch):
+    monkeypatch.setenv('MUTAGEN_HELPER_DEPTH', '2')
+    watcher = create_watcher(str(tmp_path))
+
+    group = os.path.join(str(tmp_path), 'group')
+    os.mkdir(group)
+    assert group in watcher.read(1)
+
+    project = os.path.join(group, 'project')
+    os.mkdir(project)
+    assert project in watcher.read(1)
+
+    configuration = os.path.join(project, '.mutagen-helper.yml')
+    with open(configuration, 'w') as f:
+        f.write('beta: beta1\n')
+    assert configuration in watcher.read(1)
+
+    os.mkdir(os.path.join(project, 'too-deep'))
+    assert watcher.read(0.3) == set()
@@ -1,10 +1,11 @@
 import json
 import os
+import sys
 
 import pkg_resources
 import pytest
 
-from mutagen_helper.wrapper import MutagenWrapper
+from mutagen_helper.wrapper import MutagenWrapper, ProcessTimeoutException, ProcessWrapper
 
 
 @pytest.fixture
@@ -78,3 +79,73 @@ def test_parse_with_ignores(wrapper: MutagenWrapper):
     expected_data = json.loads(
         str(pkg_resources.resource_string(__name__, "data/mutagen.json"), encoding='UTF-8'))
     assert data == expected_data
+
+
+def test_parse_json(wrapper: MutagenWrapper):
+    data = wrapper.json_list_parser.parse(
+        str(pkg_resources.resource_string(__name__, "data/mutagen-template.json"), encoding='UTF-8'))
+    expected_data = wrapper.list_parser.parse(
+        str(pkg_resources.resource_string(__name__, "data/mutagen-template.log"), encoding='UTF-8'))
+    assert data == expected_data
+    raw_data = list(wrapper.json_list_parser.iter_parse(
+        [str(pkg_resources.resource_string(__name__, "data/mutagen-template.json"), encoding='UTF-8')], raw=True))
+    assert [item['creationTime'] for item in raw_data] == \
+        ['2020-06-18T09:12:41.5082377Z', '2020-06-18T09:12:43.1011243Z']
+    assert wrapper.json_list_parser.parse('null') == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_parse_chunks(wrapper: MutagenWrapper, chunk_size):
+    for parser, resource in [(wrapper.list_parser, "data/mutagen-problems.log"),
+                             (wrapper.json_list_parser, "data/mutagen-template.json")]:
+        output = str(pkg_resources.resource_string(__name__, resource), encoding='UTF-8')
+        chunks = [output[i:i + chunk_size] for i in range(0, len(output), chunk_size)]
+        assert list(parser.iter_parse(chunks)) == parser.parse(output)
+
+
+def test_process_wrapper_run():
+    result = ProcessWrapper().run([sys.executable, '-c',
+                                   'import sys; sys.stdout.write("o" * 200000); sys.stderr.write("error"); '
+                                   'sys.exit(3)'])
+    assert result.returncode == 3
+    assert result.stdout == "o" * 200000
+    assert result.stderr == "error"
+
+
+def test_process_wrapper_run_spooled_output():
+    result = ProcessWrapper().run([sys.executable, '-c', 'import sys; sys.stdout.write("o" * 200000)'],
+                                  output_spool_size=1024)
+    assert result.returncode == 0
+    assert result.stdout == "o" * 200000
+
+
+def test_process_wrapper_stream():
+    stream = ProcessWrapper().stream([sys.executable, '-c',
+                                      'import sys; sys.stdout.write("o" * 200000); sys.stderr.write("error"); '
+                                      'sys.exit(3)'])
+    chunks = []
+    try:
+        while True:
+            chunks.append(next(stream))
+    except StopIteration as e:
+        result = e.value
+    assert ''.join(chunks) == "o" * 200000
+    assert result.returncode == 3
+    assert result.stderr == "error"
+
+
+def test_process_wrapper_run_timeout():
+    with pytest.raises(ProcessTimeoutException) as e:
+        ProcessWrapper().run([sys.executable, '-c',
+                              'import sys, time; sys.stdout.write("partial"); sys.stdout.flush(); time.sleep(5)'],
+                             timeout=0.5)
+    assert e.value.result.stdout == "partial"
+
+
+def test_process_wrapper_stream_timeout():
+    chunks = []
+    with pytest.raises(ProcessTimeoutException):
+        for chunk in ProcessWrapper().stream([sys.executable, '-c', 'import sys, time; sys.stdout.write("partial"); '
+                                                                    'sys.stdout.flush(); time.sleep(5)'], timeout=0.5):
+            chunks.append(chunk)
+    assert ''.join(chunks) == "partial"
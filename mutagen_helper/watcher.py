@@ -0,0 +1,236 @@
+"""
+Watches configuration files of a path, with inotify on linux and by polling their stats elsewhere.
+
+Only the directories scanner.configuration_files looks into are watched: each path itself and its subdirectories, down
+to the discovery depth.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+
+from . import scanner
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+
+_IN_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE \
+    | _IN_DELETE_SELF | _IN_MOVE_SELF
+
+# Events of subdirectories themselves, in their parent directory.
+_IN_DIRECTORY_CHANGES = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO
+
+_event_header = struct.Struct('iIII')
+
+
+def _root(path):
+    return os.path.dirname(os.path.abspath(path)) if os.path.isfile(path) else os.path.abspath(path)
+
+
+class Watcher(ABC):
+    """
+    Base class of watchers, reporting paths of configuration files and directories that may have changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.roots = [_root(item) for item in (path if isinstance(path, (list, tuple)) else [path])]
+        self.depth = scanner.discovery_depth()
+        self.prune = scanner.discovery_prune()
+
+    def _level(self, directory):
+        """
+        Depth of a directory below the closest root.
+        """
+        levels = []
+        for root in self.roots:
+            relpath = os.path.relpath(directory, root)
+            if relpath == os.curdir:
+                return 0
+            if relpath != os.pardir and not relpath.startswith(os.pardir + os.sep):
+                levels.append(len(relpath.split(os.sep)))
+        return min(levels) if levels else 0
+
+    @abstractmethod
+    def read(self, timeout=None):
+        """
+        Waits for changes.
+
+        :return: set of changed paths, empty when timeout has expired first
+        """
+
+    def changes(self, debounce=0.5):
+        """
+        Yields sets of changed paths, once a burst of changes has been quiet for debounce seconds.
+        """
+        while True:
+            changed = self.read()
+            if not changed:
+                continue
+            while True:
+                more = self.read(debounce)
+                if not more:
+                    break
+                changed.update(more)
+            yield changed
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    Compares stats of configuration files every interval seconds.
+    """
+
+    def __init__(self, path, interval=2.0):
+        super().__init__(path)
+        self.interval = interval
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = dict()
+        for directory in (directory for root in self.roots
+                          for directory in scanner.discovery_directories(root, self.depth, self.prune)):
+            if directory not in self.roots:
+                # Subdirectories matter only when added or removed, files synced inside change their mtime.
+                stats[directory] = None
+            for filename in scanner.configuration_filenames:
+                filepath = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                stats[filepath] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def read(self, timeout=None):
+        while True:
+            time.sleep(self.interval if timeout is None else timeout)
+            stats = self._scan()
+            changed = set(stats) ^ set(self._stats)
+            changed.update(path for path in stats if path in self._stats and stats[path] != self._stats[path])
+            self._stats = stats
+            if changed or timeout is not None:
+                return changed
+
+
+class InotifyWatcher(Watcher):
+    """
+    Receives inotify events of root directories and their subdirectories, through libc.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._directories = dict()
+        try:
+            for root in self.roots:
+                self._add_watch(root, required=True)
+                self._watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory, required=False):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if required:
+                raise OSError(error, os.strerror(error), directory)
+            logging.debug('Unable to watch directory %s: %s' % (directory, os.strerror(error)))
+            return
+        self._directories[wd] = directory
+
+    def _watch_tree(self, directory):
+        """
+        Watches subdirectories of a watched directory, down to the discovery depth.
+        """
+        watched = set(self._directories.values())
+        depth = self.depth - self._level(directory)
+        for subdirectory in scanner.discovery_directories(directory, depth, self.prune):
+            if subdirectory not in watched:
+                self._add_watch(subdirectory)
+
+    def read(self, timeout=None):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            wd, mask, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                logging.debug('Too many inotify events, considering all configuration files as changed.')
+                for root in self.roots:
+                    self._watch_tree(root)
+                    changed.add(root)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self._directories[wd]
+                continue
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                changed.add(directory)
+                continue
+            path = os.path.join(directory, name)
+            if name in scanner.configuration_filenames:
+                changed.add(path)
+            elif mask & _IN_ISDIR and mask & _IN_DIRECTORY_CHANGES and self._level(directory) < self.depth \
+                    and not scanner.is_pruned(name, self.prune):
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._watch_tree(path)
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(path, interval=None):
+    """
+    Creates an inotify watcher, or a polling watcher if an interval is given or inotify is not available.
+    """
+    if interval is None:
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            logging.debug('Unable to use inotify, polling configuration files instead: %s' % e)
+    return PollingWatcher(path, interval or 2.0)
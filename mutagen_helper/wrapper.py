@@ -1,15 +1,22 @@
+import codecs
+import itertools
+import json
 import logging
 import os
 import re
+import selectors
 import shlex
 import subprocess
 import sys
+import tempfile
 import time
 from queue import Queue, Empty
 from threading import Thread
 
 from click import ClickException
 
+from .executor import acquire_console, release_console
+
 mutagen = os.environ.get('MUTAGEN_HELPER_MUTAGEN_BIN', "mutagen.exe" if os.name == 'nt' else "mutagen")
 
 
@@ -40,10 +47,21 @@ class DaemonNotRunningException(WrapperRunException):
     pass
 
 
+class SessionNotFoundException(MutagenRunException):
+    pass
+
+
 class MultipleSessionsException(WrapperRunException):
     pass
 
 
+class ProcessTimeoutException(WrapperRunException):
+    """
+    Raised when a command has been killed because it took too long. Result holds output read until then.
+    """
+    pass
+
+
 class MutagenListParser:
     def _is_separator_line(self, line):
         return line.startswith('-' * 10)
@@ -54,24 +72,39 @@ class MutagenListParser:
     def parse(self, output, result=None):
         if not output:
             return []
-        lines = output.splitlines()
+        return list(self.iter_parse([output], result))
+
+    def _iter_lines(self, chunks):
+        pending = ''
+        for chunk in chunks:
+            lines = (pending + chunk).splitlines(True)
+            pending = ''
+            if lines and not lines[-1].endswith(('\n', '\r')):
+                pending = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r\n')
+        if pending:
+            yield pending
+
+    def iter_parse(self, chunks, result=None):
+        """
+        Parses output chunks as they come, and yields each session as soon as its separator line is read.
+        """
         first_separator_reached = False
         stack = [{}]
-        sessions = []
         current_object = {}
         previous_key = None
-        for line in lines:
+        for line in self._iter_lines(chunks):
             if not first_separator_reached:
                 if self._is_separator_line(line):
                     first_separator_reached = True
                 continue
             if self._is_separator_line(line):
-                sessions.append(stack[0])
+                yield stack[0]
                 previous_key = None
                 current_session = {}
                 stack = [current_session]
             elif self._is_no_session_line(line):
-                sessions = []
                 break
             else:
                 if ':' in line:
@@ -87,7 +120,7 @@ class MutagenListParser:
                         stack[-1][previous_key] = current_object
                         stack.append(current_object)
                     else:
-                        stack = stack[:stack_size]
+                        del stack[stack_size:]
                     stack[-1][key] = value
                     previous_key = key
                 else:
@@ -105,127 +138,455 @@ class MutagenListParser:
                         stack[-1][previous_key] = current_object
                         stack.append(current_object)
                     else:
-                        stack = stack[:stack_size]
+                        del stack[stack_size:]
 
                     if isinstance(current_object, list):
                         current_object.append(value)
                     else:
                         raise WrapperRunException("Invalid structure for mutagen output", result=result)
-        return sessions
 
 
-class ProcessWrapper:
-    STDIN = 0
-    STDOUT = 1
-    STDERR = 2
+class MutagenJsonListParser:
+    """
+    Parses sessions listed with "sync list --template '{{ json . }}'", into the same structure as
+    MutagenListParser.
+    """
+
+    # Descriptions used by mutagen for human readable status.
+    status_descriptions = {
+        'disconnected': 'Disconnected',
+        'halted-on-root-emptied': 'Halted due to one-sided root emptying',
+        'halted-on-root-deletion': 'Halted due to root deletion',
+        'halted-on-root-type-change': 'Halted due to root type change',
+        'connecting-alpha': 'Connecting to alpha',
+        'connecting-beta': 'Connecting to beta',
+        'watching': 'Watching for changes',
+        'scanning': 'Scanning files',
+        'waiting-for-rescan': 'Waiting 5 seconds for rescan',
+        'reconciling': 'Reconciling changes',
+        'staging-alpha': 'Staging files on alpha',
+        'staging-beta': 'Staging files on beta',
+        'transitioning': 'Applying changes',
+        'saving': 'Saving archive'
+    }
+
+    def _url(self, endpoint):
+        path = endpoint.get('path', '')
+        protocol = endpoint.get('protocol') or 'local'
+        if protocol == 'local':
+            return path
+        host = endpoint.get('host', '')
+        if endpoint.get('user'):
+            host = endpoint['user'] + '@' + host
+        if protocol == 'docker':
+            return 'docker://' + host + (path if path.startswith('/') else '/' + path)
+        if endpoint.get('port'):
+            host = host + ':' + str(endpoint['port'])
+        return host + ':' + path
+
+    def _endpoint(self, endpoint):
+        return {
+            'URL': self._url(endpoint),
+            'Connection state': 'Connected' if endpoint.get('connected') else 'Disconnected'
+        }
+
+    def _session(self, data):
+        session = {}
+        if data.get('name'):
+            session['Name'] = data['name']
+        session['Identifier'] = data.get('identifier')
+        labels = data.get('labels')
+        session['Labels'] = {k: str(v) for k, v in labels.items()} if labels else 'None'
+        session['Alpha'] = self._endpoint(data.get('alpha') or {})
+        session['Beta'] = self._endpoint(data.get('beta') or {})
+        if data.get('paused'):
+            session['Status'] = '[Paused]'
+        else:
+            status = data.get('status', '')
+            session['Status'] = self.status_descriptions.get(status, status)
+        if data.get('lastError'):
+            session['Last error'] = data['lastError']
+        return session
 
-    def run(self, command, print_output=False, print_output_if_idle=5000):
-        logging.debug('Running command: %s' % shlex.quote(' '.join(command)))
+    def parse(self, output, result=None):
+        if not output:
+            return []
+        return list(self.iter_parse([output], result))
 
-        process = subprocess.Popen(command,
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
+    def iter_parse(self, chunks, result=None, raw=False):
+        """
+        Decodes sessions of the JSON array one by one, as soon as output chunks contain them.
 
-        def enqueue_output(process, out, type, queue):
+        :param raw: yield sessions as mutagen gives them, instead of the structure of MutagenListParser
+        """
+        decoder = json.JSONDecoder()
+        buffer = ''
+        position = 0
+        started = False
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                buffer = buffer[position:] + chunk
+                position = 0
             while True:
-                data = out.read(1)
-                if data:
-                    queue.put((type, data))
-                if process.poll() is not None:
-                    data = out.read()
-                    if data:
-                        queue.put((type, data))
-                    out.close()
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position >= len(buffer):
                     break
-
-        def listen_stdin(queue):
-            while True:
-                data = sys.stdin.read(1)
-                if data:
-                    queue.put((ProcessWrapper.STDIN, data.encode(sys.stdin.encoding)))
-                if process.poll() is not None:
-                    data = sys.stdin.read()
-                    if data:
-                        queue.put((ProcessWrapper.STDIN, data))
+                if not started:
+                    if chunk is not None and len(buffer) - position < 4:
+                        break
+                    if buffer.startswith('null', position):
+                        return
+                    if buffer[position] != '[':
+                        raise WrapperRunException("Invalid structure for mutagen output", result=result)
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == ']':
+                    return
+                try:
+                    session_data, position = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if chunk is None:
+                        raise WrapperRunException("Invalid structure for mutagen output", result=result)
                     break
+                yield session_data if raw else self._session(session_data)
+        if started:
+            raise WrapperRunException("Invalid structure for mutagen output", result=result)
 
-        queue = Queue()
 
-        thread = Thread(target=enqueue_output, args=(process, process.stdout, ProcessWrapper.STDOUT, queue))
-        thread.daemon = True
-        thread.start()
+class _OutputBuffer:
+    """
+    Append-only output buffer, spilled to a temporary file when it grows over spool_size bytes.
+    """
 
-        stderr_thread = Thread(target=enqueue_output, args=(process, process.stderr, ProcessWrapper.STDERR, queue))
-        stderr_thread.daemon = True
-        stderr_thread.start()
+    def __init__(self, spool_size):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_size)
 
-        stdin_thread = Thread(target=listen_stdin, args=(queue,))
-        stdin_thread.daemon = True
-        stdin_thread_started = False
+    def write(self, data):
+        self._file.write(data)
 
-        # read line without blocking
-        stdout = b''
-        stderr = b''
-        stdin = b''
+    def read(self, offset, size):
+        self._file.seek(offset)
+        data = self._file.read(size)
+        self._file.seek(0, os.SEEK_END)
+        return data
 
-        recorded = []
+    def getvalue(self):
+        self._file.seek(0)
+        return self._file.read()
 
-        last_read_time = int(round(time.time() * 1000))
+    def close(self):
+        self._file.close()
+
+
+class _SelectorChannel:
+    """
+    Reads subprocess output by blocking on file descriptors readiness (POSIX).
+    """
+
+    def __init__(self, process, chunk_size):
+        self.chunk_size = chunk_size
+        # poll is preferred over epoll, as epoll refuses regular files that may be connected to stdin.
+        self.selector = selectors.PollSelector() if hasattr(selectors, 'PollSelector') else selectors.SelectSelector()
+        self.selector.register(process.stdout, selectors.EVENT_READ, ProcessWrapper.STDOUT)
+        self.selector.register(process.stderr, selectors.EVENT_READ, ProcessWrapper.STDERR)
+        self.opened = 2
+
+    @property
+    def closed(self):
+        return self.opened == 0
+
+    def listen_stdin(self):
+        try:
+            self.selector.register(sys.stdin, selectors.EVENT_READ, ProcessWrapper.STDIN)
+        except (ValueError, OSError) as e:
+            logging.debug('Unable to listen standard input: %s' % e)
+
+    def read(self, timeout=None):
+        events = []
+        for key, _ in self.selector.select(timeout):
+            data = os.read(key.fd, self.chunk_size)
+            if data:
+                events.append((key.data, data))
+            else:
+                self.selector.unregister(key.fileobj)
+                if key.data != ProcessWrapper.STDIN:
+                    self.opened -= 1
+        return events
+
+    def close(self):
+        self.selector.close()
+
+
+class _ThreadedChannel:
+    """
+    Reads subprocess output from reader threads, for platforms where pipes can't be selected (Windows).
+    """
+
+    def __init__(self, process, chunk_size):
+        self.chunk_size = chunk_size
+        self.queue = Queue()
+        self.opened = 2
+        self._start(process.stdout, ProcessWrapper.STDOUT)
+        self._start(process.stderr, ProcessWrapper.STDERR)
+
+    @property
+    def closed(self):
+        return self.opened == 0
+
+    def _start(self, stream, type):
+        thread = Thread(target=self._enqueue, args=(stream, type))
+        thread.daemon = True
+        thread.start()
+
+    def _enqueue(self, stream, type):
+        read = stream.read1 if hasattr(stream, 'read1') else stream.read
+        while True:
+            data = read(self.chunk_size)
+            self.queue.put((type, data))
+            if not data:
+                break
+
+    def listen_stdin(self):
+        self._start(sys.stdin.buffer, ProcessWrapper.STDIN)
+
+    def read(self, timeout=None):
+        try:
+            items = [self.queue.get(timeout=timeout)]
+        except Empty:
+            return []
         while True:
-            stream, data = (None, None)
             try:
-                stream, data = queue.get_nowait()
-                if stream == ProcessWrapper.STDERR or stream == ProcessWrapper.STDOUT:
-                    recorded.append((stream, data))
-                last_read_time = int(round(time.time() * 1000))
+                items.append(self.queue.get_nowait())
             except Empty:
-                if process.stdout.closed and process.stderr.closed:
-                    if queue.qsize() == 0:
+                break
+        events = []
+        for type, data in items:
+            if data:
+                events.append((type, data))
+            elif type != ProcessWrapper.STDIN:
+                self.opened -= 1
+        return events
+
+    def close(self):
+        pass
+
+
+class ProcessWrapper:
+    STDIN = 0
+    STDOUT = 1
+    STDERR = 2
+
+    chunk_size = 65536
+    output_spool_size = int(os.environ.get('MUTAGEN_HELPER_OUTPUT_SPOOL_SIZE', 1024 * 1024))
+    # Whether user may be prompted when a command seems to wait for input.
+    interactive = True
+
+    def _open_channel(self, process):
+        if os.name == 'nt':
+            return _ThreadedChannel(process, self.chunk_size)
+        return _SelectorChannel(process, self.chunk_size)
+
+    def run(self, command, print_output=False, print_output_if_idle=5000, output_spool_size=None, timeout=None):
+        """
+        Runs a command, and prints its output if it seems to wait for user input.
+
+        When timeout (in seconds) is reached, the command is killed and ProcessTimeoutException is raised with output
+        read until then. Timeout doesn't apply anymore once the user has been prompted.
+        """
+        logging.debug('Running command: %s' % shlex.quote(' '.join(command)))
+
+        process = subprocess.Popen(command,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+
+        stdout = _OutputBuffer(self.output_spool_size if output_spool_size is None else output_spool_size)
+        stderr = _OutputBuffer(self.output_spool_size if output_spool_size is None else output_spool_size)
+        buffers = {ProcessWrapper.STDOUT: stdout, ProcessWrapper.STDERR: stderr}
+        outputs = {ProcessWrapper.STDOUT: sys.stdout, ProcessWrapper.STDERR: sys.stderr}
+
+        # Sizes of output chunks received before user is prompted, so they can be replayed from buffers.
+        recorded = [] if self.interactive else None
+        console_acquired = False
+
+        deadline = time.monotonic() + timeout if timeout else None
+        timed_out = False
+
+        channel = self._open_channel(process)
+        try:
+            last_read_time = time.monotonic()
+            while not channel.closed:
+                read_timeout = None
+                if recorded:
+                    read_timeout = max(0.0, last_read_time + print_output_if_idle / 1000 - time.monotonic())
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        timed_out = True
                         break
-                else:
-                    if recorded and int(round(time.time() * 1000)) - last_read_time > print_output_if_idle:
+                    read_timeout = remaining if read_timeout is None else min(read_timeout, remaining)
+
+                events = channel.read(read_timeout)
+                if not events:
+                    if recorded and time.monotonic() - last_read_time >= print_output_if_idle / 1000:
+                        if not acquire_console(blocking=False):
+                            # Another command is already prompting the user, wait for it to finish.
+                            last_read_time = time.monotonic()
+                            continue
+                        console_acquired = True
                         logging.warning("The following mutagen command seems to require your input: ")
                         logging.warning(shlex.quote(' '.join(command))[1:-1])
                         logging.warning("Please enter your input if required, or kindly wait for it to terminate.")
                         print_output = True
-                        for stream, data in recorded:
-                            if stream == ProcessWrapper.STDOUT:
-                                sys.stdout.buffer.write(data)
-                                sys.stdout.flush()
-                            elif stream == ProcessWrapper.STDERR:
-                                sys.stderr.buffer.write(data)
-                                sys.stderr.flush()
-
-                        if not stdin_thread_started:
-                            stdin_thread_started = True
-                            stdin_thread.start()
-                        recorded = []
+                        offsets = {ProcessWrapper.STDOUT: 0, ProcessWrapper.STDERR: 0}
+                        for stream, size in recorded:
+                            outputs[stream].buffer.write(buffers[stream].read(offsets[stream], size))
+                            outputs[stream].flush()
+                            offsets[stream] += size
+                        recorded = None
+                        deadline = None
+                        channel.listen_stdin()
                     continue
 
-            if stream == ProcessWrapper.STDOUT:
-                stdout = stdout + data
-                if print_output:
-                    sys.stdout.buffer.write(data)
-            elif stream == ProcessWrapper.STDERR:
-                stderr = stderr + data
-                if print_output:
-                    sys.stderr.buffer.write(data)
-            elif stream == ProcessWrapper.STDIN:
-                stdin = stdin + data
-                process.stdin.write(data)
-                process.stdin.flush()
-
-        return subprocess.CompletedProcess(process.args, process.returncode,
-                                           str(stdout, encoding=sys.stdout.encoding),
-                                           str(stderr, encoding=sys.stdout.encoding)
-                                           )
+                last_read_time = time.monotonic()
+                for stream, data in events:
+                    if stream == ProcessWrapper.STDIN:
+                        try:
+                            process.stdin.write(data)
+                            process.stdin.flush()
+                        except BrokenPipeError:
+                            pass
+                        continue
+
+                    buffers[stream].write(data)
+                    if recorded is not None:
+                        if recorded and recorded[-1][0] == stream:
+                            recorded[-1][1] += len(data)
+                        else:
+                            recorded.append([stream, len(data)])
+                    if print_output:
+                        outputs[stream].buffer.write(data)
+                        outputs[stream].flush()
+        finally:
+            channel.close()
+            if console_acquired:
+                release_console()
+
+        if timed_out:
+            process.kill()
+        process.wait()
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+        try:
+            # Partial output may end in the middle of a character.
+            errors = 'replace' if timed_out else 'strict'
+            result = subprocess.CompletedProcess(process.args, process.returncode,
+                                                 str(stdout.getvalue(), encoding=sys.stdout.encoding, errors=errors),
+                                                 str(stderr.getvalue(), encoding=sys.stdout.encoding, errors=errors)
+                                                 )
+            if timed_out:
+                raise ProcessTimeoutException("Command has timed out after %s seconds: %s" % (
+                    timeout, shlex.quote(' '.join(command))[1:-1]), result=result)
+            return result
+        finally:
+            stdout.close()
+            stderr.close()
+
+    def stream(self, command, output_spool_size=None, timeout=None):
+        """
+        Runs a command, and yields its decoded standard output chunks as they come.
+
+        Standard output isn't kept. Once the command has terminated, the generator returns a CompletedProcess with
+        standard error only. When timeout (in seconds) is reached, the command is killed and ProcessTimeoutException
+        is raised.
+        """
+        logging.debug('Running command: %s' % shlex.quote(' '.join(command)))
+
+        process = subprocess.Popen(command,
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+
+        decoder = codecs.getincrementaldecoder(sys.stdout.encoding)()
+        stderr = _OutputBuffer(self.output_spool_size if output_spool_size is None else output_spool_size)
+
+        deadline = time.monotonic() + timeout if timeout else None
+
+        channel = self._open_channel(process)
+        try:
+            while not channel.closed:
+                read_timeout = None
+                if deadline is not None:
+                    read_timeout = deadline - time.monotonic()
+                    if read_timeout <= 0:
+                        process.kill()
+                        process.wait()
+                        raise ProcessTimeoutException("Command has timed out after %s seconds: %s" % (
+                            timeout, shlex.quote(' '.join(command))[1:-1]), result=subprocess.CompletedProcess(
+                            process.args, process.returncode, None,
+                            str(stderr.getvalue(), encoding=sys.stdout.encoding, errors='replace')))
+                for stream, data in channel.read(read_timeout):
+                    if stream == ProcessWrapper.STDOUT:
+                        chunk = decoder.decode(data)
+                        if chunk:
+                            yield chunk
+                    else:
+                        stderr.write(data)
+            chunk = decoder.decode(b'', final=True)
+            if chunk:
+                yield chunk
+
+            process.wait()
+            return subprocess.CompletedProcess(process.args, process.returncode, None,
+                                               str(stderr.getvalue(), encoding=sys.stdout.encoding))
+        finally:
+            channel.close()
+            if process.poll() is None:
+                # Consumer has stopped before the end of output.
+                process.kill()
+                process.wait()
+            for pipe in (process.stdout, process.stderr):
+                pipe.close()
+            stderr.close()
 
 
 class MutagenWrapper(ProcessWrapper):
+    # Patterns of session identifiers in control commands output.
+    control_patterns = {
+        'terminate': 'Terminating session\\s(.*?)\\.',
+        'flush': 'for session\\s(.*?)\\.',
+        'pause': 'Pausing session\\s(.*?)\\.',
+        'resume': 'Resuming session\\s(.*?)\\.'
+    }
+    json_list_template = '{{ json . }}'
+
+    # Seconds allowed to each sync command, overridden by MUTAGEN_HELPER_<COMMAND>_TIMEOUT environment variables.
+    default_timeouts = {
+        'list': 60,
+        'create': 600,
+        'terminate': 120,
+        'pause': 120,
+        'resume': 120,
+        'flush': 1800
+    }
+
     def __init__(self, mutagen="mutagen.exe" if os.name == 'nt' else "mutagen"):
         self.mutagen = mutagen
+        self.timeouts = dict()
+        for command, timeout in self.default_timeouts.items():
+            timeout = float(os.environ.get('MUTAGEN_HELPER_%s_TIMEOUT' % command.upper(), timeout))
+            # 0 disables the timeout.
+            self.timeouts[command] = timeout or None
         self.list_parser = MutagenListParser()
+        self.json_list_parser = MutagenJsonListParser()
+        # Whether mutagen supports structured listing, probed on first listing.
+        self.json_list = None if os.environ.get('MUTAGEN_HELPER_JSON_LIST', '1') != '0' else False
 
     def run(self, command, print_output=False, print_output_on_idle=5000):
         """
@@ -235,19 +596,30 @@ class MutagenWrapper(ProcessWrapper):
                                 stderr=subprocess.PIPE)
                                 """
 
-        result = super().run([self.mutagen] + command, print_output, print_output_on_idle)
+        result = super().run([self.mutagen] + command, print_output, print_output_on_idle,
+                             timeout=self.timeouts.get(command[1]) if len(command) > 1 else None)
+        return self._check_result(command, result)
+
+    def stream(self, command, output_spool_size=None):
+        result = yield from super().stream([self.mutagen] + command, output_spool_size,
+                                           timeout=self.timeouts.get(command[1]) if len(command) > 1 else None)
+        return self._check_result(command, result)
 
+    def _check_result(self, command, result):
         if result.returncode == 1 and 'unable to connect to daemon' in result.stderr:
             raise DaemonNotRunningException("Mutagen daemon doesn't seems to run. "
                                             "Start the daemon with \"mutagen daemon start\" command and try again.",
                                             result=result)
 
         if result.returncode != 0:
-            raise MutagenRunException("Mutagen has failed to execute a command: " +
-                                      (shlex.quote(' '.join([self.mutagen] + command))[1:-1]) +
-                                      (os.linesep + result.stdout if result.stdout else '') +
-                                      (os.linesep + result.stderr if result.stderr else ''),
-                                      result=result)
+            exception_class = MutagenRunException
+            if 'unable to locate requested sessions' in result.stderr:
+                exception_class = SessionNotFoundException
+            raise exception_class("Mutagen has failed to execute a command: " +
+                                  (shlex.quote(' '.join([self.mutagen] + command))[1:-1]) +
+                                  (os.linesep + result.stdout if result.stdout else '') +
+                                  (os.linesep + result.stderr if result.stderr else ''),
+                                  result=result)
 
         return result
 
@@ -260,6 +632,10 @@ class MutagenWrapper(ProcessWrapper):
         :param options:
         :return:
         """
+        result = self.run(self._create_command(alpha, beta, options))
+        return self._created_session_id(result)
+
+    def _create_command(self, alpha, beta, options=None):
         if isinstance(options, dict):
             options_list = []
             for k, v in options.items():
@@ -276,8 +652,9 @@ class MutagenWrapper(ProcessWrapper):
         elif isinstance(options, str):
             options = shlex.split(options)
 
-        command = ['sync', 'create', alpha, beta] + (list(options) if options else [])
-        result = self.run(command)
+        return ['sync', 'create', alpha, beta] + (list(options) if options else [])
+
+    def _created_session_id(self, result):
         ret = result.stdout
         match = re.search('Created session\\s(.*?)\\s', ret)
         if match:
@@ -286,62 +663,106 @@ class MutagenWrapper(ProcessWrapper):
 
     def terminate(self, session_id=None, label_selector=None, one=False):
         result = self._session_control('terminate', session_id, label_selector)
-        ret = result.stdout
-        session_ids = re.findall('Terminating session\\s(.*?)\\.', ret)
-        return self._handle_result(result, session_ids, one)
+        return self._handle_result(result, self._controlled_session_ids('terminate', result), one)
 
     def flush(self, session_id=None, label_selector=None, one=False):
         result = self._session_control('flush', session_id, label_selector)
-        ret = result.stdout
-        session_ids = re.findall('for session\\s(.*?)\\.', ret)
-        return self._handle_result(result, session_ids, one)
+        return self._handle_result(result, self._controlled_session_ids('flush', result), one)
 
     def pause(self, session_id=None, label_selector=None, one=False):
         result = self._session_control('pause', session_id, label_selector)
-        ret = result.stdout
-        session_ids = re.findall('Pausing session\\s(.*?)\\.', ret)
-        return self._handle_result(result, session_ids, one)
+        return self._handle_result(result, self._controlled_session_ids('pause', result), one)
 
     def resume(self, session_id=None, label_selector=None, one=False):
         result = self._session_control('resume', session_id, label_selector)
-        ret = result.stdout
-        session_ids = re.findall('Resuming session\\s(.*?)\\.', ret)
-        return self._handle_result(result, session_ids, one)
+        return self._handle_result(result, self._controlled_session_ids('resume', result), one)
 
     def _session_control(self, command, session_id, label_selector):
+        return self.run(self._session_control_command(command, session_id, label_selector))
+
+    def _session_control_command(self, command, session_id, label_selector):
         args = ['sync', command]
         if session_id:
-            args.append(session_id)
+            if isinstance(session_id, (list, tuple)):
+                args.extend(session_id)
+            else:
+                args.append(session_id)
         elif label_selector:
             args.append('--label-selector')
             args.append(label_selector)
         else:
             args.append('--all')
-        return self.run(args)
+        return args
+
+    def _controlled_session_ids(self, command, result):
+        return re.findall(self.control_patterns[command], result.stdout)
 
     def list(self, session_id=None, label_selector=None, long=False, one=False):
+        items = list(self.iter_list(session_id, label_selector, long))
+        return self._handle_result(None, items, one)
+
+    def iter_list(self, session_id=None, label_selector=None, long=False):
+        """
+        Yields sessions as soon as they are read from mutagen output.
+        """
+        args = self._list_command(session_id, label_selector)
+
+        if not long and self.json_list is not False:
+            # Long listing contains the whole configuration, which is only available as text.
+            yielded = False
+            try:
+                for session_info in self.json_list_parser.iter_parse(
+                        self.stream(args + ['--template', self.json_list_template])):
+                    yielded = True
+                    yield session_info
+            except SessionNotFoundException:
+                return
+            except MutagenRunException as e:
+                if self.json_list or yielded:
+                    raise
+                logging.debug('Mutagen doesn\'t support structured listing, falling back to text listing (%s)' % e)
+                self.json_list = False
+            else:
+                self.json_list = True
+                return
+
+        if long:
+            args.append('--long')
         try:
-            args = ['sync', 'list']
-            if session_id:
-                args.append(session_id)
-            if label_selector:
-                args.append('--label-selector')
-                args.append(label_selector)
-            if long:
-                args.append('--long')
-            result = self.run(args)
+            yield from self.list_parser.iter_parse(self.stream(args))
+        except SessionNotFoundException:
+            return
+
+    def creation_times(self):
+        """
+        Creation times of sessions by identifier, which only structured listing gives.
+        """
+        if self.json_list is False:
+            raise WrapperException('Creation time of sessions is only available from mutagen 0.12+ structured listing, '
+                                   'which is not supported or disabled by MUTAGEN_HELPER_JSON_LIST.')
+        args = self._list_command() + ['--template', self.json_list_template]
+        try:
+            return dict((data.get('identifier'), data.get('creationTime'))
+                        for data in self.json_list_parser.iter_parse(self.stream(args), raw=True))
+        except SessionNotFoundException:
+            return {}
         except MutagenRunException as e:
-            if 'unable to locate requested sessions' in e.result.stderr:
-                return []
-            raise
+            raise WrapperException('Creation time of sessions is only available from mutagen 0.12+ structured '
+                                   'listing: %s' % e.format_message())
 
-        parsed = self.list_parser.parse(result.stdout, result)
-        return self._handle_result(result, parsed, one)
+    def _list_command(self, session_id=None, label_selector=None):
+        args = ['sync', 'list']
+        if session_id:
+            args.append(session_id)
+        if label_selector:
+            args.append('--label-selector')
+            args.append(label_selector)
+        return args
 
     def _handle_result(self, result, items, one):
         if one:
             if len(items) > 1:
-                raise MultipleSessionsException(result)
+                raise MultipleSessionsException("Multiple sessions found", result=result)
             elif len(items) == 1:
                 return items[0]
             else: